@@ -0,0 +1,12 @@
+# src/api/metrics.py
+from fastapi import APIRouter
+
+from src.utils.metrics import snapshot
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+def metrics():
+    """Contadores internos (cachés, etc.) en JSON."""
+    return {"metrics": snapshot()}
@@ -58,41 +58,79 @@ def get_workspace_credentials(scopes: Optional[Iterable[str]] = WORKSPACE_SCOPES
     # Cloud Run (ADC)
     return _adc_credentials(scopes_t)
 
+# --- TRANSPORTE HTTP (pool de conexiones, thread-safe) ---
+class PooledHttp:
+    """
+    Adaptador con la interfaz de `httplib2.Http.request` (la que espera
+    googleapiclient) sobre un `AuthorizedSession` de requests/urllib3:
+    pool de conexiones keep-alive de tamaño configurable y seguro para
+    compartir entre los hilos de las background tasks (httplib2 no lo es).
+    """
+
+    def __init__(self, credentials: BaseCredentials, *, pool_size: int, timeout: float):
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+
+        # BatchHttpRequest lee `http.credentials` para firmar cada sub-petición
+        self.credentials = credentials
+        self.timeout = timeout
+        self._session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        import httplib2
+
+        resp = self._session.request(
+            method,
+            uri,
+            data=body,
+            headers=headers,
+            timeout=self.timeout,
+            allow_redirects=redirections > 0,
+        )
+        info = {k.lower(): v for k, v in resp.headers.items()}
+        info.pop("content-encoding", None)  # requests ya descomprimió el cuerpo
+        info["status"] = str(resp.status_code)
+        response = httplib2.Response(info)
+        response.reason = resp.reason
+        return response, resp.content
+
+    def close(self) -> None:
+        self._session.close()
+
+
+@lru_cache(maxsize=1)
+def get_authorized_http() -> PooledHttp:
+    """Transporte compartido por los clientes Drive/Docs/Sheets (cacheado)."""
+    creds = get_workspace_credentials(WORKSPACE_SCOPES)
+    logger.info(
+        f"🔌 Transporte Google API con pool de {settings.google_api_pool_size} conexiones "
+        f"(timeout={settings.google_api_timeout_s}s)."
+    )
+    return PooledHttp(creds, pool_size=settings.google_api_pool_size, timeout=settings.google_api_timeout_s)
+
 # --- CLIENTES GOOGLE API ---
+# Los objetos `Resource` solo construyen peticiones; el envío pasa por el
+# transporte con pool, así que es seguro compartirlos entre hilos.
 @lru_cache(maxsize=4)
 def build_drive_client():
-    creds = get_workspace_credentials(WORKSPACE_SCOPES)
     logger.info("📁 Cliente Drive inicializado (cacheado).")
-    return build("drive", "v3", credentials=creds, cache_discovery=False)
+    return build("drive", "v3", http=get_authorized_http(), cache_discovery=False)
 
 
-# src/auth.py
 @lru_cache(maxsize=4)
 def build_docs_client():
-    from google_auth_httplib2 import AuthorizedHttp
-    import httplib2
-    import certifi
-    from googleapiclient.discovery import build
-
-    creds = get_workspace_credentials(WORKSPACE_SCOPES)
     logger.info("📄 Cliente Docs inicializado (cacheado).")
-
-    base_http = httplib2.Http(
-        timeout=180,  # subimos a 180s
-        ca_certs=certifi.where(),  # CA actualizadas
-        disable_ssl_certificate_validation=False,
-    )
-    authed_http = AuthorizedHttp(creds, http=base_http)
-
     # NO mezclar credentials= con http=
-    return build("docs", "v1", http=authed_http, cache_discovery=False)
+    return build("docs", "v1", http=get_authorized_http(), cache_discovery=False)
 
 
 @lru_cache(maxsize=4)
 def build_sheets_client():
-    creds = get_workspace_credentials(WORKSPACE_SCOPES)
     logger.info("📊 Cliente Sheets inicializado (cacheado).")
-    return build("sheets", "v4", credentials=creds, cache_discovery=False)
+    return build("sheets", "v4", http=get_authorized_http(), cache_discovery=False)
 
 # --- VERTEX AI ---
 @lru_cache(maxsize=1)
@@ -0,0 +1,113 @@
+# src/clients/batch_client.py
+from __future__ import annotations
+
+import random
+import socket
+import ssl
+import time
+from dataclasses import dataclass
+from http.client import IncompleteRead
+from typing import Any, Callable, Dict, List, Optional
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from src.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+_TRANSPORT_ERRORS = (IncompleteRead, ConnectionResetError, BrokenPipeError, ssl.SSLError, socket.timeout, OSError)
+
+
+@dataclass
+class BatchItemResult:
+    """Resultado por elemento de un batch: respuesta JSON o error."""
+    key: str
+    response: Optional[Dict[str, Any]] = None
+    error: Optional[Exception] = None
+    attempts: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def status(self) -> Optional[int]:
+        if isinstance(self.error, HttpError):
+            status = getattr(self.error, "status_code", None) or getattr(self.error.resp, "status", None)
+            return int(status) if status else None
+        return None
+
+    @property
+    def retryable(self) -> bool:
+        if self.error is None:
+            return False
+        if isinstance(self.error, HttpError):
+            return self.status in _RETRY_STATUSES
+        return isinstance(self.error, _TRANSPORT_ERRORS)
+
+
+def execute_batch(
+    service: Any,
+    factories: Dict[str, Callable[[], HttpRequest]],
+    *,
+    max_retries: int = 3,
+    max_batch_size: Optional[int] = None,
+) -> Dict[str, BatchItemResult]:
+    """
+    Ejecuta muchas llamadas de metadatos (Drive/Docs) multiplexadas en
+    `BatchHttpRequest` (una petición HTTPS por grupo de `max_batch_size`).
+    - `factories`: {clave: función que construye el HttpRequest}. Se usan
+      factorías para poder reconstruir la petición al reintentar.
+    - Reintenta SOLO los elementos con error transitorio (429/5xx/red),
+      con backoff exponencial + jitter.
+    Nunca lanza por errores de un elemento: revisa `BatchItemResult.ok`.
+    """
+    size = max(1, max_batch_size or settings.google_batch_max_size)
+    results: Dict[str, BatchItemResult] = {k: BatchItemResult(key=k) for k in factories}
+    pending: List[str] = list(factories)
+    delay = 1.0
+
+    for attempt in range(1, max_retries + 1):
+        for start in range(0, len(pending), size):
+            group = pending[start:start + size]
+            _execute_group(service, factories, group, results)
+
+        pending = [k for k in pending if results[k].retryable]
+        if not pending or attempt == max_retries:
+            break
+        sleep = delay + random.uniform(0, delay * 0.5)
+        logger.warning(f"🔁 Batch retry {attempt}/{max_retries}: {len(pending)} elemento(s). Esperando {sleep:.1f}s…")
+        time.sleep(sleep)
+        delay = min(delay * 2, 20)
+
+    failed = sum(1 for r in results.values() if not r.ok)
+    logger.info(f"📦 Batch: {len(results)} elemento(s), {failed} con error.")
+    return results
+
+
+def _execute_group(
+    service: Any,
+    factories: Dict[str, Callable[[], HttpRequest]],
+    group: List[str],
+    results: Dict[str, BatchItemResult],
+) -> None:
+    def _callback(request_id: str, response: Any, exception: Optional[Exception]) -> None:
+        item = results[request_id]
+        item.response = response if exception is None else None
+        item.error = exception
+
+    batch = service.new_batch_http_request()
+    for key in group:
+        results[key].attempts += 1
+        batch.add(factories[key](), callback=_callback, request_id=key)
+    try:
+        batch.execute()
+    except (HttpError, *_TRANSPORT_ERRORS) as e:
+        # Falla el batch completo: todos los elementos del grupo heredan el error
+        logger.warning(f"⚠️ Batch de {len(group)} elemento(s) falló completo: {e}")
+        for key in group:
+            results[key].response = None
+            results[key].error = e
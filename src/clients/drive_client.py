@@ -1,14 +1,20 @@
 # src/clients/drive_client.py
 from __future__ import annotations
 
+import hashlib
 import re
+import tempfile
+import time
+from dataclasses import dataclass
 from io import BytesIO
-from typing import Optional
+from typing import IO, Dict, Iterable, Optional, Tuple
 
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
 
 from src.auth import build_drive_client, build_docs_client
+from src.clients.batch_client import BatchItemResult, execute_batch
+from src.settings import settings
 from src.utils.logger import get_logger
 
 logger = get_logger(__name__)
@@ -39,33 +45,134 @@ def find_file_in_folder_by_name(
     files = resp.get("files", [])
     return files[0] if files else None
 
+class FileAccessError(Exception):
+    """
+    Error estructurado de acceso/lectura de un archivo (Docs o Drive).
+    Conserva el HttpError original como `__cause__`.
+    """
+
+    def __init__(self, file_id: str, *, api: str, status: Optional[int], reason: str = "", detail: str = ""):
+        self.file_id = file_id
+        self.api = api
+        self.status = status
+        self.reason = reason
+        self.detail = detail
+        super().__init__(f"[{api}] Sin acceso a {file_id} (HTTP {status} {reason}): {detail}".strip())
+
+    @classmethod
+    def from_http_error(cls, file_id: str, api: str, err: HttpError) -> "FileAccessError":
+        status = getattr(err, "status_code", None) or getattr(err.resp, "status", None)
+        return cls(
+            file_id,
+            api=api,
+            status=int(status) if status else None,
+            reason=str(getattr(err, "reason", "") or ""),
+            detail=str(err),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "file_id": self.file_id,
+            "api": self.api,
+            "status": self.status,
+            "reason": self.reason,
+        }
+
+# Máscaras mínimas: para validar acceso no hace falta descargar el cuerpo del Doc.
+DOCS_ACCESS_FIELDS = "documentId,revisionId"
+DRIVE_ACCESS_FIELDS = "id,mimeType,size"
+
+def _get_access_metadata(file_id: str, *, use_docs_api: bool) -> dict:
+    if use_docs_api:
+        docs = build_docs_client()
+        return docs.documents().get(documentId=file_id, fields=DOCS_ACCESS_FIELDS).execute()
+    drive = build_drive_client()
+    return drive.files().get(
+        fileId=file_id,
+        fields=DRIVE_ACCESS_FIELDS,
+        supportsAllDrives=True,
+    ).execute()
+
 def assert_sa_has_access(file_id: str, *, use_docs_api: bool = True) -> None:
     """
     Verifica que la Service Account actual pueda acceder al archivo.
     - Por defecto usa Docs API (mejor para Google Docs) porque con 'drive.file'
       Drive puede ocultar 403 como 404 por privacidad.
     - Si el archivo no es un Google Doc (p. ej. PDF binario), usa use_docs_api=False para forzar Drive API.
+    Solo pide una máscara mínima de campos (no descarga el cuerpo del Doc).
     Lanza HttpError si no hay acceso.
     """
+    api = "Docs" if use_docs_api else "Drive"
+    try:
+        _get_access_metadata(file_id, use_docs_api=use_docs_api)
+    except HttpError as e:
+        logger.error(f"[{api} Access] SA no puede acceder a {file_id}: {e}")
+        raise
+
+def check_file_access(file_id: str, *, use_docs_api: bool = True) -> dict:
+    """
+    Como `assert_sa_has_access`, pero devuelve los metadatos mínimos
+    (`documentId/revisionId` en Docs; `id/mimeType/size` en Drive)
+    y lanza `FileAccessError` en lugar de HttpError.
+    """
+    api = "docs" if use_docs_api else "drive"
+    try:
+        return _get_access_metadata(file_id, use_docs_api=use_docs_api)
+    except HttpError as e:
+        err = FileAccessError.from_http_error(file_id, api, e)
+        logger.error(f"🔒 {err}")
+        raise err from e
+
+def batch_get_file_metadata(
+    file_ids: Iterable[str],
+    *,
+    use_docs_api: bool = True,
+    fields: Optional[str] = None,
+) -> Dict[str, BatchItemResult]:
+    """
+    Metadatos de muchos archivos (de un job o de una carpeta de jobs) en
+    peticiones HTTP batch, con resultado y reintento por elemento.
+    Por defecto usa las máscaras mínimas de acceso.
+    """
+    ids = list(dict.fromkeys(file_ids))  # dedup conservando orden
     if use_docs_api:
         docs = build_docs_client()
-        try:
-            docs.documents().get(documentId=file_id).execute()
-            return
-        except HttpError as e:
-            logger.error(f"[Docs Access] SA no puede acceder a {file_id}: {e}")
-            raise
+        mask = fields or DOCS_ACCESS_FIELDS
+        factories = {
+            fid: (lambda fid=fid: docs.documents().get(documentId=fid, fields=mask))
+            for fid in ids
+        }
+        return execute_batch(docs, factories)
 
     drive = build_drive_client()
-    try:
-        drive.files().get(
-            fileId=file_id,
-            fields="id,name,mimeType,owners,permissions",
-            supportsAllDrives=True,
-        ).execute()
-    except HttpError as e:
-        logger.error(f"[Drive Access] SA no puede acceder a {file_id}: {e}")
-        raise
+    mask = fields or DRIVE_ACCESS_FIELDS
+    factories = {
+        fid: (lambda fid=fid: drive.files().get(fileId=fid, fields=mask, supportsAllDrives=True))
+        for fid in ids
+    }
+    return execute_batch(drive, factories)
+
+def check_files_access(file_ids: Iterable[str], *, use_docs_api: bool = True) -> Dict[str, dict]:
+    """
+    Versión batch de `check_file_access`: valida todos los archivos con una
+    sola petición multiplexada y devuelve `{file_id: metadatos}`.
+    Registra todos los fallos y lanza `FileAccessError` con el primero.
+    """
+    api = "docs" if use_docs_api else "drive"
+    results = batch_get_file_metadata(file_ids, use_docs_api=use_docs_api)
+    errors = []
+    for fid, item in results.items():
+        if item.ok:
+            continue
+        if isinstance(item.error, HttpError):
+            err = FileAccessError.from_http_error(fid, api, item.error)
+        else:
+            err = FileAccessError(fid, api=api, status=None, detail=str(item.error))
+        logger.error(f"🔒 {err}")
+        errors.append(err)
+    if errors:
+        raise errors[0]
+    return {fid: item.response or {} for fid, item in results.items()}
 
 def grant_editor_to_sa(file_id: str, sa_email: str) -> None:
     """
@@ -104,3 +211,76 @@ def download_file_bytes(file_id: str) -> bytes:
     while not done:
         _, done = downloader.next_chunk()
     return fh.getvalue()
+
+
+@dataclass
+class SpooledDownload:
+    """Archivo de Drive descargado en un `SpooledTemporaryFile`, con su sha256 calculado al vuelo."""
+    file: IO[bytes]
+    sha256: str
+    size: int
+
+    @property
+    def in_memory(self) -> bool:
+        return not getattr(self.file, "_rolled", True)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class _HashingWriter:
+    """`fd` para MediaIoBaseDownload: escribe en `fh` y va actualizando el sha256."""
+
+    def __init__(self, fh: IO[bytes]):
+        self.fh = fh
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.hasher.update(data)
+        self.size += len(data)
+        return self.fh.write(data)
+
+
+def download_file_to(file_id: str, fh: IO[bytes]) -> Tuple[str, int]:
+    """
+    Descarga un archivo de Drive por trozos (`drive_download_chunk_size`) a
+    `fh` (archivo, spool o writer de GCS). Devuelve (sha256, tamaño).
+    """
+    drive = build_drive_client()
+    request = drive.files().get_media(fileId=file_id, supportsAllDrives=True)
+    writer = _HashingWriter(fh)
+    downloader = MediaIoBaseDownload(fd=writer, request=request, chunksize=settings.drive_download_chunk_size)
+    done = False
+    while not done:
+        _, done = downloader.next_chunk()
+    return writer.hasher.hexdigest(), writer.size
+
+
+def download_file_spooled(file_id: str, *, size: Optional[int] = None) -> SpooledDownload:
+    """
+    Descarga un archivo de Drive a un archivo temporal que solo vive en RAM
+    hasta `pdf_spool_max_memory_bytes`; por encima se vuelca a disco
+    (`pdf_spool_dir`). Si se sabe de antemano (`size`) que no cabe, va directo
+    a un archivo con nombre en `pdf_spool_dir` (que el split puede reutilizar).
+    El llamador debe cerrarlo.
+    """
+    if size is not None and size > settings.pdf_spool_max_memory_bytes and settings.pdf_spool_dir:
+        spool: IO[bytes] = tempfile.NamedTemporaryFile(dir=settings.pdf_spool_dir, suffix=".pdf")
+    else:
+        spool = tempfile.SpooledTemporaryFile(
+            max_size=settings.pdf_spool_max_memory_bytes, dir=settings.pdf_spool_dir
+        )
+    t0 = time.perf_counter()
+    try:
+        sha256, total = download_file_to(file_id, spool)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    result = SpooledDownload(file=spool, sha256=sha256, size=total)
+    logger.info(
+        f"⬇️ Drive {file_id}: {result.size / 1e6:.1f} MB en {time.perf_counter() - t0:.2f}s "
+        f"({'memoria' if result.in_memory else 'disco'})."
+    )
+    return result
@@ -1,12 +1,187 @@
 # src/clients/gcs_client.py
-from google.cloud import storage
+from __future__ import annotations
+
+import hashlib
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import IO, Callable, Dict, Iterable, List, Optional, Set
 from uuid import uuid4
-from datetime import datetime
 
-def upload_bytes(bucket_name: str, data: bytes, suffix: str = ".pdf") -> str:
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    path = f"uploads/{datetime.utcnow():%Y/%m/%d}/{uuid4()}{suffix}"
+from google.cloud import storage
+
+from src.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+@lru_cache(maxsize=1)
+def get_storage_client() -> storage.Client:
+    """
+    Cliente GCS único del proceso, con pool keep-alive dimensionado para las
+    subidas en paralelo (el `storage.Client()` por defecto abre 10 conexiones).
+    """
+    from google.auth.transport.requests import AuthorizedSession
+    from requests.adapters import HTTPAdapter
+
+    from src.auth import WORKSPACE_SCOPES, get_workspace_credentials
+
+    creds = get_workspace_credentials(WORKSPACE_SCOPES)
+    session = AuthorizedSession(creds)
+    pool = max(settings.google_api_pool_size, settings.gcs_upload_concurrency)
+    adapter = HTTPAdapter(pool_connections=pool, pool_maxsize=pool, max_retries=0)
+    session.mount("https://", adapter)
+    logger.info(f"🪣 Cliente GCS inicializado (cacheado, pool de {pool} conexiones).")
+    return storage.Client(project=settings.gcp_project_id, credentials=creds, _http=session)
+
+
+def upload_bytes(bucket_name: str, data: bytes, suffix: str = ".pdf", *,
+                 path: Optional[str] = None, content_type: str = "application/pdf",
+                 custom_time: Optional[datetime] = None) -> str:
+    """
+    Sube `data` a `path` (por defecto `uploads/YYYY/MM/DD/<uuid><suffix>`).
+    `custom_time` fija el `customTime` del objeto (caducidad por último uso).
+    """
+    bucket = get_storage_client().bucket(bucket_name)
+    path = path or f"uploads/{datetime.utcnow():%Y/%m/%d}/{uuid4()}{suffix}"
     blob = bucket.blob(path)
-    blob.upload_from_string(data, content_type="application/pdf")
+    if custom_time is not None:
+        blob.custom_time = custom_time
+    t0 = time.perf_counter()
+    blob.upload_from_string(data, content_type=content_type)
+    logger.info(f"⬆️ gs://{bucket_name}/{path} ({len(data) / 1e6:.1f} MB) en {time.perf_counter() - t0:.2f}s")
+    return f"gs://{bucket_name}/{path}"
+
+
+def upload_file(bucket_name: str, fh: IO[bytes], *, path: str, size: Optional[int] = None,
+                content_type: str = "application/pdf", custom_time: Optional[datetime] = None) -> str:
+    """
+    Sube un archivo abierto con upload resumable por trozos de
+    `gcs_upload_chunk_size`: nunca lo carga entero en memoria.
+    """
+    blob = get_storage_client().bucket(bucket_name).blob(path, chunk_size=settings.gcs_upload_chunk_size)
+    if custom_time is not None:
+        blob.custom_time = custom_time
+    t0 = time.perf_counter()
+    blob.upload_from_file(fh, rewind=True, size=size, content_type=content_type)
+    mb = (size if size is not None else blob.size or 0) / 1e6
+    logger.info(f"⬆️ gs://{bucket_name}/{path} ({mb:.1f} MB, resumable) en {time.perf_counter() - t0:.2f}s")
     return f"gs://{bucket_name}/{path}"
+
+
+def upload_many(bucket_name: str, chunks: Iterable[bytes], *, suffix: str = ".pdf",
+                path_for: Optional[Callable[[int], str]] = None,
+                concurrency: Optional[int] = None,
+                custom_time: Optional[datetime] = None) -> List[str]:
+    """
+    Sube `chunks` en paralelo y devuelve las gs:// URIs en el mismo orden.
+    `chunks` se consume a medida que hay hueco: si es un generador (split del
+    PDF), el split del siguiente chunk se solapa con las subidas en curso y
+    nunca hay más de `concurrency` chunks en memoria esperando.
+    `path_for(i)` fija la ruta del chunk i (por defecto, `uploads/...` con uuid).
+    """
+    workers = max(1, concurrency or settings.gcs_upload_concurrency)
+    uris: Dict[int, str] = {}
+    pending: Set[Future] = set()
+    t0 = time.perf_counter()
+
+    def _collect(done: Iterable[Future]) -> None:
+        for fut in done:
+            idx, uri = fut.result()  # propaga el primer error de subida
+            uris[idx] = uri
+
+    def _upload(idx: int, data: bytes) -> tuple[int, str]:
+        return idx, upload_bytes(bucket_name, data, suffix=suffix, path=path_for(idx) if path_for else None,
+                                 custom_time=custom_time)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gcs-upload") as pool:
+        try:
+            for idx, data in enumerate(chunks):
+                if len(pending) >= workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    _collect(done)
+                pending.add(pool.submit(_upload, idx, data))
+            done, pending = wait(pending)
+            _collect(done)
+        except BaseException:
+            for fut in pending:
+                fut.cancel()
+            raise
+
+    logger.info(f"📤 {len(uris)} objeto(s) subidos a gs://{bucket_name} en {time.perf_counter() - t0:.2f}s "
+                f"(concurrencia={workers}).")
+    return [uris[i] for i in range(len(uris))]
+
+
+def touch_blobs(blobs: Iterable[storage.Blob], *, min_interval: timedelta = timedelta(hours=1)) -> int:
+    """
+    Marca objetos como usados ahora (`customTime`), para que un lifecycle con
+    `daysSinceCustomTime` caduque lo que no se usa y no lo que es antiguo.
+    Solo parchea los que llevan más de `min_interval` sin marcar (GCS no deja
+    retrasar `customTime`, solo adelantarlo). Devuelve cuántos parcheó.
+    """
+    now = datetime.now(timezone.utc)
+    stale = [b for b in blobs if b.custom_time is None or now - b.custom_time > min_interval]
+    if not stale:
+        return 0
+
+    def _touch(blob: storage.Blob) -> None:
+        blob.custom_time = now
+        blob.patch()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(stale), settings.gcs_upload_concurrency)),
+                            thread_name_prefix="gcs-touch") as pool:
+        list(pool.map(_touch, stale))
+    logger.info(f"🕒 customTime renovado en {len(stale)} objeto(s).")
+    return len(stale)
+
+
+def parse_gs_uri(uri: str) -> tuple[str, str]:
+    """gs://bucket/path/obj.pdf → ("bucket", "path/obj.pdf")."""
+    if not uri.startswith("gs://"):
+        raise ValueError(f"URI GCS inválida: {uri}")
+    bucket, _, path = uri[len("gs://"):].partition("/")
+    return bucket, path
+
+def _fingerprint(blob: storage.Blob) -> str:
+    # md5 no existe en objetos compuestos; crc32c siempre
+    return f"md5:{blob.md5_hash}" if blob.md5_hash else f"crc32c:{blob.crc32c}:{blob.size}"
+
+def object_fingerprint(uri: str) -> str:
+    """Hash de contenido de un objeto GCS leído de sus metadatos (sin descargarlo)."""
+    bucket_name, path = parse_gs_uri(uri)
+    blob = get_storage_client().bucket(bucket_name).get_blob(path)
+    if blob is None:
+        raise FileNotFoundError(uri)
+    return _fingerprint(blob)
+
+
+@dataclass
+class GCSObjectFile:
+    """Objeto GCS abierto para lectura por rangos (`blob.open("rb")`), sin descargarlo entero."""
+    uri: str
+    file: IO[bytes]
+    sha256: str   # clave de contenido: sha256 del md5/crc32c del objeto (no del contenido)
+    size: int
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def open_object(uri: str, *, sha256: Optional[str] = None) -> GCSObjectFile:
+    """
+    Abre un objeto para lectura con seek: cada lectura pide un rango de
+    `gcs_read_chunk_size` bytes (fijado a la generación leída en los metadatos).
+    `sha256` (si se conoce el del contenido) sustituye a la clave por metadatos.
+    """
+    bucket_name, path = parse_gs_uri(uri)
+    blob = get_storage_client().bucket(bucket_name).get_blob(path)
+    if blob is None:
+        raise FileNotFoundError(uri)
+    key = sha256 or hashlib.sha256(_fingerprint(blob).encode("utf-8")).hexdigest()
+    logger.info(f"📄 {uri}: {blob.size / 1e6:.1f} MB (lectura por rangos).")
+    return GCSObjectFile(uri=uri, file=blob.open("rb", chunk_size=settings.gcs_read_chunk_size),
+                         sha256=key, size=blob.size)
@@ -1,20 +1,29 @@
 # src/clients/gdocs_client.py
 from __future__ import annotations
 
+import difflib
 import time
 import random
 import socket
 import ssl
 import json
 
-from typing import Any, Dict, List, Optional, TypedDict, cast, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple, TypedDict, cast, Iterator
 from http.client import IncompleteRead
 
 from googleapiclient.errors import HttpError
 from googleapiclient.http import HttpRequest
-from src.utils.md2gdocs import MarkdownToDocs
+from src.utils.md2gdocs import MarkdownToDocs, coalesce_requests
 from src.auth import build_docs_client
+from src.clients.drive_client import (
+    DOCS_ACCESS_FIELDS, FileAccessError, batch_get_file_metadata, check_files_access
+)
+from src.settings import settings
 from src.utils.logger import get_logger
+from src.utils.metrics import register_metrics
+from src.utils.ttl_cache import TTLCache
 
 logger = get_logger(__name__)
 
@@ -33,6 +42,8 @@ class Body(TypedDict, total=False):
     content: List[StructuralElement]
 
 class Document(TypedDict, total=False):
+    documentId: str
+    revisionId: str
     title: str
     body: Body
 
@@ -71,11 +82,6 @@ def _execute_with_retries(request: HttpRequest, *, max_retries: int = 6) -> Opti
             logger.warning(f"🔁 Retry {attempt}/{max_retries} por {kind}: {e}. Esperando {sleep:.1f}s…")
             time.sleep(sleep)
             delay = min(delay * 2, 20)
-            # ⚠️ Para intentos altos, re-crea el cliente (por si la sesión quedó “sucia”)
-            if attempt >= 3:
-                from src.auth import build_docs_client
-                _ = build_docs_client.cache_clear()  # limpia cache lru si usas Python 3.9+, si no, ignóralo
-                build_docs_client()  # reconstruye cliente
             continue
         except HttpError as e:
             status = getattr(e, "status_code", None) or getattr(e.resp, "status", None)
@@ -104,18 +110,136 @@ def _iter_text(doc: Document) -> Iterator[str]:
             if content:
                 yield content
 
+def _fetch_document(document_id: str, *, fields: Optional[str] = None) -> Document:
+    docs = build_docs_client()
+    kwargs: Dict[str, Any] = {"documentId": document_id}
+    if fields:
+        kwargs["fields"] = fields
+    get_req: HttpRequest = docs.documents().get(**kwargs)
+    doc_raw: Optional[Dict[str, Any]] = _execute_with_retries(get_req)
+    return cast(Document, doc_raw or {})
+
 def get_document_content(document_id: str) -> str:
     """
     Devuelve el texto plano del Google Doc `document_id`.
     Hace `documents.get` y concatena todos los `textRun.content`.
     """
-    docs = build_docs_client()
-    get_req: HttpRequest = docs.documents().get(documentId=document_id)
-    doc_raw: Optional[Dict[str, Any]] = _execute_with_retries(get_req)
-    doc: Document = cast(Document, doc_raw)
+    doc = _fetch_document(document_id)
     # Concatena conservando saltos de línea que vienen en los textRuns
     return "".join(_iter_text(doc))
 
+# --- LOADER: acceso + contenido en una sola petición ---
+
+@dataclass(frozen=True)
+class LoadedDocument:
+    document_id: str
+    revision_id: str
+    title: str
+    text: str
+
+def load_document(document_id: str) -> LoadedDocument:
+    """
+    Valida acceso y devuelve el contenido parseado con UNA sola `documents.get`
+    (sustituye al par `assert_sa_has_access` + `get_document_content`).
+    Lanza `FileAccessError` si la SA no puede leer el Doc.
+    """
+    try:
+        doc = _fetch_document(document_id)
+    except HttpError as e:
+        err = FileAccessError.from_http_error(document_id, "docs", e)
+        logger.error(f"🔒 {err}")
+        raise err from e
+    return LoadedDocument(
+        document_id=document_id,
+        revision_id=doc.get("revisionId", "") or "",
+        title=doc.get("title", "") or "",
+        text="".join(_iter_text(doc)),
+    )
+
+def check_document_access(document_id: str) -> str:
+    """
+    Chequeo de acceso puro (p. ej. Doc de salida) con máscara mínima
+    `documentId,revisionId`. Devuelve el `revisionId` ("" si no viene).
+    Lanza `FileAccessError`.
+    """
+    try:
+        doc = _fetch_document(document_id, fields=DOCS_ACCESS_FIELDS)
+    except HttpError as e:
+        err = FileAccessError.from_http_error(document_id, "docs", e)
+        logger.error(f"🔒 {err}")
+        raise err from e
+    return doc.get("revisionId", "") or ""
+
+# --- CACHÉ DE DOCS DE PROMPTS (clave: doc_id + revisión) ---
+
+_doc_cache: TTLCache[str] = TTLCache(
+    max_entries=settings.docs_cache_max_entries,
+    ttl_s=settings.docs_cache_ttl_s,
+    max_bytes=settings.docs_cache_max_chars,
+    sizeof=len,
+)
+register_metrics("docs_content_cache", _doc_cache.stats)
+
+def get_document_revision(document_id: str) -> str:
+    """Versión de un Doc (ver `get_document_revisions`). Lanza `FileAccessError`."""
+    return get_document_revisions((document_id,))[document_id]
+
+def _drive_modified_times(document_ids: List[str]) -> Dict[str, str]:
+    """`modifiedTime` de Drive por Doc en un batch; "" si no se pudo leer (no es fatal)."""
+    results = batch_get_file_metadata(document_ids, use_docs_api=False, fields="id,modifiedTime")
+    mtimes: Dict[str, str] = {}
+    for doc_id, item in results.items():
+        if not item.ok:
+            logger.warning(f"No se pudo leer modifiedTime de {doc_id}: {item.error}")
+        mtimes[doc_id] = (item.response or {}).get("modifiedTime") or ""
+    return mtimes
+
+def get_document_revisions(document_ids: Iterable[str]) -> Dict[str, str]:
+    """
+    Acceso + versión de varios Docs. Chequeo barato de frescura: máscara
+    mínima, sin descargar el cuerpo. Docs solo devuelve `revisionId` con
+    permiso de edición; para una SA de solo lectura la versión es el
+    `modifiedTime` de Drive. Los batch de Docs y de Drive van en paralelo
+    (un batch HTTP no mezcla APIs): la latencia es la de uno solo y no hay
+    que volver a pedir cada Doc. Devuelve `{doc_id: versión}` ("" si no hay
+    ninguna). Lanza `FileAccessError` si alguno no es accesible.
+    """
+    ids = list(dict.fromkeys(document_ids))
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="drive_mtime") as pool:
+        mtimes = pool.submit(_drive_modified_times, ids)
+        metas = check_files_access(ids, use_docs_api=True)
+        modified = mtimes.result()
+    revisions: Dict[str, str] = {}
+    for doc_id, meta in metas.items():
+        rev = meta.get("revisionId", "") or ""
+        revisions[doc_id] = rev or (f"mtime:{modified[doc_id]}" if modified.get(doc_id) else "")
+    return revisions
+
+def get_cached_document_content(document_id: str, *, revision: Optional[str] = None) -> str:
+    """
+    Como `load_document(...).text`, pero cacheado por (doc_id, revisión).
+    Pensado para los Docs de system/base prompt, que casi nunca cambian:
+    en un hit solo se paga el chequeo de revisión, no la descarga del cuerpo.
+    Si el llamador ya conoce la revisión (p. ej. de `get_document_revisions`),
+    se omite el chequeo. Lanza `FileAccessError`.
+    """
+    if not settings.docs_cache_enabled:
+        return load_document(document_id).text
+
+    revision = revision or get_document_revision(document_id)
+    if revision:
+        cached = _doc_cache.get((document_id, revision))
+        if cached is not None:
+            logger.debug(f"📦 Doc {document_id}@{revision} servido desde caché.")
+            return cached
+
+    loaded = load_document(document_id)
+    # Si el cuerpo trae una revisión más nueva que la del chequeo, manda esa
+    revision = loaded.revision_id or revision
+    if revision:
+        _doc_cache.put((document_id, revision), loaded.text)
+    return loaded.text
+
 # ========= Helpers tipados =========
 
 def _get_end_index(doc: Document) -> int:
@@ -134,64 +258,241 @@ def _get_end_index(doc: Document) -> int:
 
 # ========= Operaciones de escritura =========
 
-def write_to_document(document_id: str, text: str) -> None:
+_REVISION_CONFLICT_RETRIES = 2
+
+def _is_revision_conflict(err: HttpError) -> bool:
+    """400 por `writeControl.requiredRevisionId` desfasado (alguien editó el Doc entre medias)."""
+    status = getattr(err, "status_code", None) or getattr(err.resp, "status", None)
+    return int(status or 0) == 400 and "revision" in str(err).lower()
+
+# Campos para difear: índices y texto de cada párrafo (tablas/índices → reescritura completa)
+_DIFF_FIELDS = "revisionId,body(content(startIndex,endIndex,sectionBreak,paragraph(elements(textRun(content)))))"
+
+def _doc_paragraphs(doc: Document) -> Optional[List[Tuple[int, int, str]]]:
+    """[(startIndex, endIndex, texto)] de los párrafos del cuerpo; None si hay elementos no difeables."""
+    paragraphs: List[Tuple[int, int, str]] = []
+    for el in cast(Body, doc.get("body", {})).get("content", []):
+        if "sectionBreak" in el:
+            continue
+        para = el.get("paragraph")
+        if para is None:
+            return None
+        text = "".join(e.get("textRun", {}).get("content", "") for e in para.get("elements", []))
+        paragraphs.append((int(el.get("startIndex", 0)), int(el.get("endIndex", 0)), text))
+    return paragraphs or None
+
+def _group_by_chars(requests: List[Dict[str, Any]], max_ops: Optional[int] = None) -> List[List[Dict[str, Any]]]:
     """
-    Borra el contenido (sin tocar el newline final) e inserta `text` al inicio.
-    Seguro con retries y chunking.
+    Agrupa peticiones (ya ordenadas) en batches de hasta `docs_write_batch_max_chars`
+    chars insertados (y, si se indica, hasta `max_ops` peticiones).
     """
-    MAX_CHARS = 50000  # ⬅️ de 80k a 50k
-    docs = build_docs_client()
+    batches: List[List[Dict[str, Any]]] = [[]]
+    size = 0
+    for req in requests:
+        n = len(req.get("insertText", {}).get("text", ""))
+        full = max_ops is not None and len(batches[-1]) >= max_ops
+        if full or (size and size + n > settings.docs_write_batch_max_chars):
+            batches.append([])
+            size = 0
+        batches[-1].append(req)
+        size += n
+    return [b for b in batches if b]
+
+def _incremental_batches(doc: Document, text: str) -> Optional[List[List[Dict[str, Any]]]]:
+    """
+    Diff por párrafos (difflib) entre el Doc actual y `text`: solo borra/inserta
+    los tramos cambiados, de abajo a arriba para que los índices de los tramos
+    anteriores sigan valiendo. None si no conviene (estructura no difeable o
+    más de `docs_incremental_max_change_ratio` de párrafos cambiados).
+    """
+    paragraphs = _doc_paragraphs(doc)
+    if paragraphs is None:
+        return None
+    old = [t for _, _, t in paragraphs]
+    new = [p + "\n" for p in text.split("\n")]  # el cuerpo siempre acaba en el newline raíz
+    ops = [op for op in difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes() if op[0] != "equal"]
+    changed = sum(max(i2 - i1, j2 - j1) for _, i1, i2, j1, j2 in ops)
+    if changed > settings.docs_incremental_max_change_ratio * max(len(old), len(new)):
+        return None
+
+    starts = [start for start, _, _ in paragraphs]
+    doc_end = paragraphs[-1][1]
+
+    def _delete(start: int, end: int) -> List[Dict[str, Any]]:
+        return [{"deleteContentRange": {"range": {"startIndex": start, "endIndex": end}}}] if end > start else []
+
+    def _insert(index: int, value: str) -> List[Dict[str, Any]]:
+        return [{"insertText": {"location": {"index": index}, "text": value}}] if value else []
+
+    requests: List[Dict[str, Any]] = []
+    for _, i1, i2, j1, j2 in reversed(ops):
+        new_text = "".join(new[j1:j2])
+        if i2 < len(old):
+            requests += _delete(starts[i1], starts[i2]) + _insert(starts[i1], new_text)
+        elif j1 == j2:
+            # Quitar párrafos finales: se borra el newline previo, nunca el del segmento raíz
+            requests += _delete(starts[i1] - 1, doc_end - 1)
+        elif i1 < len(old):
+            # Reemplazo hasta el final: el newline raíz se conserva
+            requests += _delete(starts[i1], doc_end - 1) + _insert(starts[i1], new_text[:-1])
+        else:
+            # Añadir al final: antes del newline raíz
+            requests += _insert(doc_end - 1, "\n" + new_text[:-1])
+    return _group_by_chars(requests)
+
+def _replace_document_batches(end_index: int, text: str) -> List[List[Dict[str, Any]]]:
+    """
+    Peticiones para reemplazar el cuerpo por `text`: borrado (sin tocar el
+    newline del segmento raíz) + inserts en orden al final del segmento, de
+    `docs_text_chunk` chars, agrupados en batches de hasta
+    `docs_write_batch_max_chars` chars.
+    """
+    requests: List[Dict[str, Any]] = []
+    delete_end = max(1, end_index - 1)
+    if delete_end > 1:
+        requests.append({"deleteContentRange": {"range": {"startIndex": 1, "endIndex": delete_end}}})
+    slice_chars = max(1, settings.docs_text_chunk)
+    for start in range(0, len(text), slice_chars):
+        requests.append({"insertText": {"endOfSegmentLocation": {}, "text": text[start:start + slice_chars]}})
+    return _group_by_chars(requests)
+
+def _guarded_batch_update(document_id: str, requests: List[Dict[str, Any]],
+                          revision: Optional[str]) -> Optional[str]:
+    """
+    `batchUpdate` con `writeControl.requiredRevisionId` (si se conoce la
+    revisión): falla si alguien editó el Doc entre medias. Devuelve la
+    revisión resultante, para encadenar el siguiente batch.
+    """
+    body: Dict[str, Any] = {"requests": requests}
+    if revision:
+        body["writeControl"] = {"requiredRevisionId": revision}
+    resp = _execute_with_retries(build_docs_client().documents().batchUpdate(documentId=document_id, body=body))
+    return ((resp or {}).get("writeControl") or {}).get("requiredRevisionId")
+
+def _write_document(document_id: str, text: str, *, incremental: bool) -> Optional[str]:
+    """`write_to_document`, devolviendo la revisión final del Doc."""
+    t0 = time.perf_counter()
+    for attempt in range(1, _REVISION_CONFLICT_RETRIES + 2):
+        doc = _fetch_document(document_id, fields=_DIFF_FIELDS if incremental else "revisionId,body(content(endIndex))")
+        revision = doc.get("revisionId")
+        batches = _incremental_batches(doc, text) if incremental else None
+        mode = "incremental"
+        if batches is None:
+            batches = _replace_document_batches(_get_end_index(doc), text)
+            mode = "completa"
+        try:
+            for batch in batches:
+                revision = _guarded_batch_update(document_id, batch, revision)
+        except HttpError as e:
+            if not _is_revision_conflict(e) or attempt > _REVISION_CONFLICT_RETRIES:
+                raise
+            logger.warning(f"🔁 El Doc {document_id} cambió durante la escritura; se reescribe "
+                           f"(intento {attempt + 1}).")
+            continue
+        ops = sum(len(b) for b in batches)
+        logger.info(f"✍️ Escritura {mode}: {len(text)} chars, {ops} op(s) en {len(batches)} batchUpdate(s), "
+                    f"{time.perf_counter() - t0:.2f}s.")
+        return revision
+    return None
 
-    # 1) Obtener endIndex
-    get_req: HttpRequest = docs.documents().get(documentId=document_id)
-    doc_raw: Optional[Dict[str, Any]] = _execute_with_retries(get_req)
-    doc: Document = cast(Document, doc_raw)
-    end_index: int = _get_end_index(doc)  # p.ej. 123
+def write_to_document(document_id: str, text: str, *, incremental: Optional[bool] = None) -> None:
+    """
+    Deja el Doc con exactamente `text`, en un `batchUpdate` (o pocos, acotados
+    por tamaño).
+    - Incremental (`docs_incremental_write`): lee el Doc una vez, lo difea por
+      párrafos contra `text` y solo envía las operaciones de los tramos
+      cambiados. Si no conviene, cae a la reescritura completa.
+    - Completa: borrado + inserts en orden con `endOfSegmentLocation`.
+    Cada batch lleva `writeControl.requiredRevisionId` (encadenado con la
+    revisión que devuelve el anterior); si alguien edita el Doc entre medias,
+    se relee y se vuelve a escribir.
+    """
+    incremental = settings.docs_incremental_write if incremental is None else incremental
+    _write_document(document_id, text, incremental=incremental)
 
-    # ⚠️ Importante: NO borrar el newline final del segmento raíz
-    # Si el doc tiene contenido, end_index >= 2; borramos hasta end_index - 1
-    delete_end = max(1, end_index - 1)
 
-    # 2) Delete all (solo si hay algo que borrar)
-    if delete_end > 1:
-        delete_req: HttpRequest = docs.documents().batchUpdate(
-            documentId=document_id,
-            body={
-                "requests": [
-                    {
-                        "deleteContentRange": {
-                            "range": {"startIndex": 1, "endIndex": delete_end}
-                        }
-                    }
-                ]
-            },
-        )
-        _execute_with_retries(delete_req)
-
-    # 3) Insert (en chunks para evitar timeouts/payloads grandes)
-    MAX_CHARS = 80000
-    if len(text) <= MAX_CHARS:
-        insert_body: Dict[str, Any] = {
-            "requests": [
-                {"insertText": {"location": {"index": 1}, "text": text}}
-            ]
-        }
-        insert_req: HttpRequest = docs.documents().batchUpdate(
-            documentId=document_id, body=insert_body
-        )
-        _execute_with_retries(insert_req)
-    else:
-        start = 0
-        part = 1
-        while start < len(text):
-            chunk = text[start:start + MAX_CHARS]
-            insert_body = {"requests": [{"insertText": {"location": {"index": 1}, "text": chunk}}]}
-            insert_req: HttpRequest = docs.documents().batchUpdate(documentId=document_id, body=insert_body)
-            _execute_with_retries(insert_req)
-            logger.info(f"✍️ Insertado chunk {part} ({len(chunk)} chars)")
-            start += MAX_CHARS
-            part += 1
-            time.sleep(0.15)  # ⬅️ 150ms para no “aplanar” el backend
+_INTERRUPTED_NOTE = "\n\n[⚠️ Generación interrumpida ({error}): el contenido anterior está incompleto.]\n"
+
+def write_stream_to_document(document_id: str, chunks: Iterable[str]) -> str:
+    """
+    Escritura incremental: borra el Doc y va agregando al final
+    (`endOfSegmentLocation`) los fragmentos según llegan del modelo, para que
+    la latencia del modelo se solape con la de Docs.
+    Agrupa fragmentos pequeños hasta `docs_stream_flush_chars` o
+    `docs_stream_flush_ms` (el primero se escribe de inmediato).
+    - Cada escritura va con `writeControl.requiredRevisionId` encadenado; si
+      alguien edita el Doc entre medias, se reescribe con todo lo generado.
+    - Si el stream termina sin contenido, el Doc queda vacío (como la
+      escritura no-stream con "").
+    - Si el stream falla a medias, se añade una nota visible de generación
+      interrumpida antes de relanzar el error.
+    Devuelve el texto completo escrito.
+    """
+    t0 = time.perf_counter()
+    last_flush = t0
+    pending: List[str] = []
+    written: List[str] = []
+    flushes = 0
+    revision: Optional[str] = None
+
+    def _append(text: str) -> None:
+        nonlocal revision
+        if flushes == 0:
+            # Se limpia justo con el primer fragmento: si el modelo falla
+            # antes de producir nada, el Doc conserva su contenido anterior
+            revision = _write_document(document_id, text, incremental=False)
+            return
+        try:
+            revision = _guarded_batch_update(
+                document_id, [{"insertText": {"endOfSegmentLocation": {}, "text": text}}], revision
+            )
+        except HttpError as e:
+            if not _is_revision_conflict(e):
+                raise
+            logger.warning(f"🔁 El Doc {document_id} cambió durante la escritura en streaming; se reescribe.")
+            revision = _write_document(document_id, "".join(written) + text, incremental=True)
+
+    def _flush() -> None:
+        nonlocal last_flush, flushes
+        text = "".join(pending)
+        pending.clear()
+        if not text:
+            return
+        _append(text)
+        written.append(text)
+        flushes += 1
+        last_flush = time.perf_counter()
+        if flushes == 1:
+            logger.info(f"✍️ Primer contenido en el Doc a los {(last_flush - t0):.1f}s.")
+
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            pending.append(chunk)
+            size = sum(len(p) for p in pending)
+            elapsed_ms = (time.perf_counter() - last_flush) * 1000
+            if flushes == 0 or size >= settings.docs_stream_flush_chars or elapsed_ms >= settings.docs_stream_flush_ms:
+                _flush()
+        _flush()
+    except Exception as e:
+        if flushes:
+            # El Doc ya se limpió: que no parezca un resultado completo
+            try:
+                pending.append(_INTERRUPTED_NOTE.format(error=type(e).__name__))
+                _flush()
+            except Exception as note_err:
+                logger.warning(f"⚠️ No se pudo marcar el Doc {document_id} como incompleto: {note_err}")
+        raise
+
+    if flushes == 0:
+        logger.info("ℹ️ El modelo no devolvió contenido; se deja el Doc vacío.")
+        _write_document(document_id, "", incremental=False)
+
+    total = "".join(written)
+    logger.info(f"✅ Escritura incremental: {len(total)} chars en {flushes} escritura(s), "
+                f"{time.perf_counter() - t0:.1f}s.")
+    return total
 
 
 def _batch_update_docs(document_id: str, requests: List[Dict[str, Any]]):
@@ -224,7 +525,7 @@ def write_markdown_to_document(
     markdown_text: str,
     *,
     clear_before_write: bool = True,
-    max_ops_per_batch: int = 200,
+    max_ops_per_batch: Optional[int] = None,
     sleep_ms_between_batches: int = 150,
     list_policy: str = "auto",
 ) -> None:
@@ -237,6 +538,8 @@ def write_markdown_to_document(
 
     Usa `list_policy="none"` para desactivar viñetas (y limpiar cualquier
     bullet 'heredado' de párrafos).
+    Las requests se compactan (`coalesce_requests`) antes de enviarse en
+    batches de hasta `docs_markdown_max_ops_per_batch` ops.
     """
     # 1) Limpiar el documento (opcional, dejando el newline raíz)
     if clear_before_write:
@@ -255,19 +558,20 @@ def write_markdown_to_document(
     # 4) Construir requests desde el Markdown con la política de listas deseada
     policy = "none" if str(list_policy).lower() == "none" else "auto"
     renderer = MarkdownToDocs(initial_index=start_index, list_policy=policy)
-    requests = renderer.render(markdown_text or "")
-
-    # 5) Enviar en lotes con backoff suave (igual que tu writer plano)
-    i = 0
-    total = len(requests)
-    if total == 0:
+    raw = renderer.render(markdown_text or "")
+    requests = coalesce_requests(raw, max_insert_chars=settings.docs_text_chunk)
+    if not requests:
         return
 
-    while i < total:
-        chunk = requests[i:i + max_ops_per_batch]
-        _batch_update_docs(document_id, chunk)
-        i += max_ops_per_batch
-        time.sleep(sleep_ms_between_batches / 1000.0)
+    # 5) Enviar en lotes con backoff suave
+    t0 = time.perf_counter()
+    batches = _group_by_chars(requests, max_ops=max_ops_per_batch or settings.docs_markdown_max_ops_per_batch)
+    for n, batch in enumerate(batches):
+        if n:
+            time.sleep(sleep_ms_between_batches / 1000.0)
+        _batch_update_docs(document_id, batch)
+    logger.info(f"🖋️ Markdown → Docs: {len(raw)} → {len(requests)} op(s) en {len(batches)} batchUpdate(s), "
+                f"{time.perf_counter() - t0:.2f}s.")
 
 
 
@@ -0,0 +1,192 @@
+# src/clients/rate_limiter.py
+from __future__ import annotations
+
+import random
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Dict, TypeVar
+
+from src.settings import settings
+from src.utils.logger import get_logger
+from src.utils.metrics import register_metrics
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# Ventana de ráfaga: cada bucket admite hasta N segundos de su ritmo acumulado
+_BURST_S = 10.0
+# Tras un 429 no se vuelve a reducir el ritmo hasta pasado este tiempo
+# (varias llamadas concurrentes suelen recibir el 429 a la vez)
+_DECREASE_COOLDOWN_S = 5.0
+
+
+def is_rate_limited(err: BaseException) -> bool:
+    """
+    True si el error es un 429 / RESOURCE_EXHAUSTED de Vertex, por tipo de
+    excepción o código de estado (nunca por el texto del mensaje).
+    """
+    try:
+        from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+        if isinstance(err, (ResourceExhausted, TooManyRequests)):
+            return True
+    except ImportError:  # pragma: no cover
+        pass
+    code = getattr(err, "code", None)
+    if callable(code):  # grpc.RpcError
+        try:
+            return getattr(code(), "name", "") == "RESOURCE_EXHAUSTED"
+        except Exception:
+            return False
+    if code == 429:  # GoogleAPICallError genérico
+        return True
+    resp = getattr(err, "resp", None)  # googleapiclient HttpError
+    return getattr(resp, "status", None) == 429
+
+
+def is_transient(err: BaseException) -> bool:
+    """Errores de servidor/red que vale la pena reintentar (503, 500, timeouts)."""
+    try:
+        from google.api_core.exceptions import DeadlineExceeded, InternalServerError, ServiceUnavailable
+        return isinstance(err, (DeadlineExceeded, InternalServerError, ServiceUnavailable))
+    except ImportError:  # pragma: no cover
+        return False
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket doble (peticiones/min y tokens/min) compartido por todas las
+    llamadas a Vertex del proceso, con adaptación AIMD:
+    - cada 429 multiplica el ritmo por `decrease` (con enfriamiento),
+    - cada éxito lo sube `increase` (fracción del techo) hasta el máximo.
+    Expone ritmo actual y profundidad de cola vía `stats()`.
+    """
+
+    def __init__(self, *, rpm: int, tpm: int, min_fraction: float = 0.05,
+                 decrease: float = 0.5, increase: float = 0.02):
+        self.max_rpm = max(1, rpm)
+        self.max_tpm = max(1, tpm)
+        self.min_fraction = min_fraction
+        self.decrease = decrease
+        self.increase = increase
+        self._fraction = 1.0
+        self._req_level = self._req_capacity()
+        self._tok_level = self._tok_capacity()
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._cv = threading.Condition()
+        self._waiting = 0
+        self.calls = 0
+        self.throttles = 0
+        self.retries = 0
+
+    # ---------- ritmo actual ----------
+    def _rpm(self) -> float:
+        return self.max_rpm * self._fraction
+
+    def _tpm(self) -> float:
+        return self.max_tpm * self._fraction
+
+    def _req_capacity(self) -> float:
+        return max(1.0, self._rpm() * _BURST_S / 60)
+
+    def _tok_capacity(self) -> float:
+        return max(1.0, self._tpm() * _BURST_S / 60)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._req_level = min(self._req_capacity(), self._req_level + elapsed * self._rpm() / 60)
+        self._tok_level = min(self._tok_capacity(), self._tok_level + elapsed * self._tpm() / 60)
+
+    # ---------- API ----------
+    def acquire(self, tokens: int) -> None:
+        """
+        Bloquea hasta que haya cupo para 1 petición y `tokens` tokens.
+        Una petición mayor que la capacidad del bucket pasa con el bucket lleno
+        y lo deja en negativo (deuda), así nunca se bloquea para siempre.
+        """
+        with self._cv:
+            self._waiting += 1
+            try:
+                while True:
+                    self._refill()
+                    need_tok = min(float(tokens), self._tok_capacity())
+                    if self._req_level >= 1 and self._tok_level >= need_tok:
+                        self._req_level -= 1
+                        self._tok_level -= tokens
+                        self.calls += 1
+                        return
+                    wait_req = (1 - self._req_level) * 60 / self._rpm()
+                    wait_tok = (need_tok - self._tok_level) * 60 / self._tpm()
+                    self._cv.wait(timeout=min(max(wait_req, wait_tok, 0.01), 5.0))
+            finally:
+                self._waiting -= 1
+
+    def on_success(self) -> None:
+        with self._cv:
+            if self._fraction < 1.0:
+                self._fraction = min(1.0, self._fraction + self.increase)
+                self._cv.notify_all()
+
+    def on_throttle(self) -> None:
+        with self._cv:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._last_decrease < _DECREASE_COOLDOWN_S:
+                return
+            self._last_decrease = now
+            self._fraction = max(self.min_fraction, self._fraction * self.decrease)
+            self._req_level = min(self._req_level, 0.0)  # vacía la ráfaga acumulada
+            logger.warning(f"🚦 429 de Vertex: ritmo reducido a {self._rpm():.1f} rpm / {self._tpm():.0f} tpm.")
+
+    def run(self, fn: Callable[[], T], *, est_tokens: int, label: str = "vertex",
+            max_retries: int | None = None) -> T:
+        """
+        Ejecuta `fn` respetando el limitador. En 429 (y errores transitorios)
+        reintenta con backoff exponencial y jitter completo.
+        """
+        attempts = max(1, max_retries or settings.vertex_max_retries)
+        delay = settings.vertex_retry_base_s
+        for attempt in range(1, attempts + 1):
+            self.acquire(est_tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                throttled = is_rate_limited(e)
+                if throttled:
+                    self.on_throttle()
+                if attempt == attempts or not (throttled or is_transient(e)):
+                    raise
+                sleep = random.uniform(delay / 2, delay)
+                self.retries += 1
+                logger.warning(f"🔁 {label}: retry {attempt}/{attempts} por "
+                               f"{'429' if throttled else e.__class__.__name__}. Esperando {sleep:.1f}s…")
+                time.sleep(sleep)
+                delay = min(delay * 2, 60)
+                continue
+            self.on_success()
+            return result
+        raise RuntimeError("unreachable")  # pragma: no cover
+
+    def stats(self) -> Dict[str, float]:
+        with self._cv:
+            return {
+                "rpm": round(self._rpm(), 2),
+                "tpm": round(self._tpm()),
+                "rate_fraction": round(self._fraction, 3),
+                "queue_depth": self._waiting,
+                "calls": self.calls,
+                "throttles": self.throttles,
+                "retries": self.retries,
+            }
+
+
+@lru_cache(maxsize=1)
+def get_vertex_limiter() -> AdaptiveRateLimiter:
+    """Limitador único del proceso para todas las llamadas de generación a Vertex."""
+    limiter = AdaptiveRateLimiter(rpm=settings.vertex_rpm, tpm=settings.vertex_tpm)
+    register_metrics("vertex_rate_limiter", limiter.stats)
+    return limiter
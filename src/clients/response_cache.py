@@ -0,0 +1,229 @@
+# src/clients/response_cache.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Protocol
+
+from src.settings import settings
+from src.utils.logger import get_logger
+from src.utils.metrics import register_metrics
+from src.utils.ttl_cache import TTLCache
+
+logger = get_logger(__name__)
+
+
+def make_key(model_id: str, texts: Iterable[str], file_hashes: Iterable[str] = ()) -> str:
+    """Clave direccionada por contenido: sha256(modelo + prompt completo + hashes de adjuntos)."""
+    payload = json.dumps(
+        {"model": model_id, "texts": list(texts), "files": list(file_hashes)},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(Protocol):
+    def get(self, key: str) -> Optional[str]: ...
+    def put(self, key: str, value: str) -> None: ...
+    def stats(self) -> Dict[str, float]: ...
+
+
+class MemoryResponseCache:
+    """LRU en memoria (por instancia de Cloud Run) con TTL y tope de bytes."""
+
+    def __init__(self, *, ttl_s: int, max_entries: int, max_bytes: int):
+        self._cache: TTLCache[str] = TTLCache(
+            max_entries=max_entries, ttl_s=ttl_s, max_bytes=max_bytes, sizeof=len
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    def put(self, key: str, value: str) -> None:
+        self._cache.put(key, value)
+
+    def stats(self) -> Dict[str, float]:
+        return {"backend": "memory", **self._cache.stats()}
+
+
+class DiskResponseCache:
+    """
+    Un archivo por respuesta en `root` (p. ej. /tmp). TTL por mtime; al
+    superar `max_entries`/`max_bytes` se borran primero los más antiguos.
+    """
+
+    def __init__(self, root: str, *, ttl_s: int, max_entries: int, max_bytes: int):
+        self.root = root
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.txt")
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_s:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, "r", encoding="utf-8") as fh:
+                value = fh.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        # Escritura atómica: tmp + replace (lecturas concurrentes nunca ven un archivo a medias)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                fh.write(value)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            try:
+                os.remove(tmp)  # p. ej. disco lleno: no dejar el .tmp a medias
+            except OSError:
+                pass
+            raise
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.root):
+                if not name.endswith(".txt"):
+                    continue
+                path = os.path.join(self.root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+            entries.sort()  # más antiguos primero
+            now = time.time()
+            total = sum(size for _, size, _ in entries)
+            count = len(entries)
+            for mtime, size, path in entries:
+                expired = now - mtime > self.ttl_s
+                if not expired and count <= self.max_entries and total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                count -= 1
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        return {"backend": "disk", "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class GCSResponseCache:
+    """
+    Objetos `gs://<bucket>/<prefix><key>.txt`, compartidos entre instancias.
+    TTL por `time_created`: lo caducado se borra al leerlo, y lo que nadie
+    vuelve a leer lo borra la regla de lifecycle sobre `prefix`
+    (`ensure_response_cache_lifecycle`). Errores distintos de NotFound
+    (403, 5xx…) se propagan: el llamador los trata como fallo de caché.
+    """
+
+    def __init__(self, bucket_name: str, prefix: str, *, ttl_s: int):
+        from src.clients.gcs_client import get_storage_client
+
+        self._bucket = get_storage_client().bucket(bucket_name)
+        self.prefix = prefix
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str) -> Optional[str]:
+        from google.api_core.exceptions import NotFound
+
+        blob = self._bucket.blob(f"{self.prefix}{key}.txt")
+        try:
+            blob.reload()
+            created = blob.time_created
+            if created and (datetime.now(timezone.utc) - created).total_seconds() > self.ttl_s:
+                self._count(hit=False)
+                try:
+                    blob.delete()
+                except NotFound:
+                    pass  # otra instancia se adelantó
+                return None
+            value = blob.download_as_text(encoding="utf-8")
+        except NotFound:
+            self._count(hit=False)
+            return None
+        self._count(hit=True)
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        blob = self._bucket.blob(f"{self.prefix}{key}.txt")
+        blob.upload_from_string(value.encode("utf-8"), content_type="text/plain; charset=utf-8")
+
+    def stats(self) -> Dict[str, float]:
+        return {"backend": "gcs", "hits": self.hits, "misses": self.misses}
+
+
+@lru_cache(maxsize=1)
+def get_response_cache() -> Optional[ResponseCache]:
+    """Backend configurado en `response_cache_backend` (None si está desactivado)."""
+    backend = (settings.response_cache_backend or "none").lower()
+    cache: Optional[ResponseCache] = None
+    if backend == "memory":
+        cache = MemoryResponseCache(
+            ttl_s=settings.response_cache_ttl_s,
+            max_entries=settings.response_cache_max_entries,
+            max_bytes=settings.response_cache_max_bytes,
+        )
+    elif backend == "disk":
+        cache = DiskResponseCache(
+            settings.response_cache_dir,
+            ttl_s=settings.response_cache_ttl_s,
+            max_entries=settings.response_cache_max_entries,
+            max_bytes=settings.response_cache_max_bytes,
+        )
+    elif backend == "gcs":
+        bucket = settings.response_cache_bucket or settings.pdf_staging_bucket
+        if not bucket:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=gcs requiere RESPONSE_CACHE_BUCKET o PDF_STAGING_BUCKET.")
+        cache = GCSResponseCache(bucket, settings.response_cache_prefix, ttl_s=settings.response_cache_ttl_s)
+        try:
+            from src.services.pdf_staging import ensure_response_cache_lifecycle
+            ensure_response_cache_lifecycle()
+        except Exception as e:  # p. ej. sin storage.buckets.update: avisar, no romper
+            logger.warning(f"⚠️ No se pudo aplicar el lifecycle de {settings.response_cache_prefix} en "
+                           f"gs://{bucket}: {e}. Aplícalo con `python -m src.services.pdf_staging`.")
+    elif backend != "none":
+        raise ValueError(f"RESPONSE_CACHE_BACKEND desconocido: {backend}")
+
+    if cache is not None:
+        register_metrics("vertex_response_cache", cache.stats)
+        logger.info(f"♻️ Caché de respuestas del modelo activa (backend={backend}).")
+    return cache
@@ -1,66 +1,529 @@
 # src/clients/vertex_client.py
+import hashlib
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from vertexai.preview import caching
 from vertexai.preview.generative_models import GenerativeModel, Part
 from src.auth import init_vertex_ai
+from src.clients.gcs_client import object_fingerprint
+from src.clients.rate_limiter import get_vertex_limiter, is_rate_limited, is_transient
+from src.clients.response_cache import ResponseCache, get_response_cache, make_key
 from src.settings import settings
 from src.utils.logger import get_logger
+from src.utils.metrics import register_metrics
+from src.utils.ttl_cache import TTLCache
 
 logger = get_logger(__name__)
 
-def generate_text(prompt: str) -> str:
-    init_vertex_ai()
-    model_id = settings.vertex_model_id
-    logger.info(f"🤖 Solicitando respuesta a modelo {model_id}...")
+# --- Caché de respuestas (opt-in, direccionada por contenido) ---
+
+def _response_cache_key(model_id: str, prompt: str, gcs_uris: list[str], cache_scope: str,
+                        inline_pdfs: Sequence[bytes] = ()) -> Optional[str]:
+    """
+    Clave = hash(modelo + prompt completo + hashes de contenido de los adjuntos).
+    `cache_scope` representa la parte del prompt que viaja fuera de `prompt`
+    (p. ej. el prefijo system+base de un modelo con context caching).
+    Devuelve None si no se puede obtener el hash de algún adjunto.
+    """
+    hashes = []
+    for uri in gcs_uris:
+        try:
+            hashes.append(object_fingerprint(uri))
+        except Exception as e:
+            logger.warning(f"Sin hash de contenido para {uri} ({e}); la respuesta no se cachea.")
+            return None
+    hashes += [f"sha256:{hashlib.sha256(data).hexdigest()}" for data in inline_pdfs]
+    return make_key(model_id, [cache_scope, prompt], hashes)
+
+def _cache_get(cache: ResponseCache, key: str) -> Optional[str]:
+    try:
+        return cache.get(key)
+    except Exception as e:  # la caché es un atajo: nunca rompe el job
+        logger.warning(f"⚠️ No se pudo leer la caché de respuestas: {e}")
+        return None
+
+def _cache_put(cache: ResponseCache, key: str, value: str) -> None:
+    try:
+        cache.put(key, value)
+    except Exception as e:  # la llamada al modelo ya está pagada: se devuelve igual
+        logger.warning(f"⚠️ No se pudo guardar en la caché de respuestas: {e}")
+
+def _with_response_cache(model_id: str, prompt: str, gcs_uris: list[str], *, cache_scope: str,
+                         use_cache: bool, call: Callable[[], str], inline_pdfs: Sequence[bytes] = ()) -> str:
+    cache = get_response_cache() if use_cache else None
+    key = _response_cache_key(model_id, prompt, gcs_uris, cache_scope, inline_pdfs) if cache else None
+    if cache and key:
+        hit = _cache_get(cache, key)
+        if hit is not None:
+            logger.info(f"♻️ Respuesta de {model_id} servida desde caché ({len(hit)} chars).")
+            return hit
+    text = call()
+    if cache and key and text:
+        _cache_put(cache, key, text)
+    return text
+
+def _stream_with_response_cache(model_id: str, prompt: str, gcs_uris: list[str], *, cache_scope: str,
+                                use_cache: bool, call: Callable[[], Iterator[str]],
+                                inline_pdfs: Sequence[bytes] = ()) -> Iterator[str]:
+    cache = get_response_cache() if use_cache else None
+    key = _response_cache_key(model_id, prompt, gcs_uris, cache_scope, inline_pdfs) if cache else None
+    if cache and key:
+        hit = _cache_get(cache, key)
+        if hit is not None:
+            logger.info(f"♻️ Respuesta de {model_id} servida desde caché ({len(hit)} chars).")
+            yield hit
+            return
+    parts: List[str] = []
+    for piece in call():
+        parts.append(piece)
+        yield piece
+    if cache and key and parts:
+        _cache_put(cache, key, "".join(parts))
+
+# --- Ruteo de modelos por etapa (map / reduce / single-shot) ---
+
+def select_model(stage: str, *, input_tokens: Optional[int] = None) -> str:
+    """
+    Modelo para una etapa del job:
+    - "map": `vertex_map_model_id` (rápido/barato) o el modelo por defecto.
+    - "reduce": `vertex_reduce_model_id` (más capaz) o el modelo por defecto.
+    - "single": `vertex_small_model_id` si la entrada no supera
+      `vertex_small_input_max_tokens`; si no, el modelo por defecto.
+    Queda registrado en el log del job.
+    """
+    default = settings.vertex_model_id
+    if stage == "map":
+        model_id = settings.vertex_map_model_id or default
+    elif stage == "reduce":
+        model_id = settings.vertex_reduce_model_id or default
+    elif (settings.vertex_small_model_id and input_tokens is not None
+          and input_tokens <= settings.vertex_small_input_max_tokens):
+        model_id = settings.vertex_small_model_id
+    else:
+        model_id = default
+    tokens = f" (input≈{input_tokens} tokens)" if input_tokens is not None else ""
+    logger.info(f"🧭 Modelo etapa={stage}: {model_id}{tokens}")
+    return model_id
+
+# --- Límite de ritmo compartido (rpm/tpm + AIMD en 429) ---
+
+def _estimate_tokens(prompt: str, n_files: int = 0) -> int:
+    """Estimación barata para el bucket de tokens: ~4 chars/token + un chunk objetivo por adjunto."""
+    return len(prompt) // 4 + n_files * settings.plan_target_chunk_tokens
+
+def _limited(fn: Callable, *, est_tokens: int, label: str):
+    return get_vertex_limiter().run(fn, est_tokens=est_tokens, label=label)
+
+def _start_stream(fn: Callable[[], Iterable]) -> Iterator:
+    """
+    Arranca un stream y consume su primer fragmento, para que un 429 (que
+    llega en el primer `next`) pase por el limitador y sus reintentos.
+    """
+    it = iter(fn())
     try:
-        model = GenerativeModel(model_id)
-        response = model.generate_content(prompt)
-        logger.debug(f"Respuesta generada ({len(response.text)} caracteres).")
-        return response.text
-    except Exception as e:
-        logger.error(f"Error al generar texto en Vertex AI: {e}")
-        raise
+        first = next(it)
+    except StopIteration:
+        return iter(())
+    return itertools.chain([first], it)
+
+def _file_parts(gcs_uris: Sequence[str], inline_pdfs: Sequence[bytes]) -> list:
+    """PDFs por referencia (gs://) y/o inline (bytes en la propia petición)."""
+    return (
+        [Part.from_uri(uri, mime_type="application/pdf") for uri in gcs_uris]
+        + [Part.from_data(data=data, mime_type="application/pdf") for data in inline_pdfs]
+    )
+
+def generate_text(prompt: str, *, model: Optional[GenerativeModel] = None,
+                  model_id: Optional[str] = None,
+                  cache_scope: str = "", use_cache: bool = True) -> str:
+    init_vertex_ai()
+    model_id = model_id or settings.vertex_model_id
+
+    def _call() -> str:
+        logger.info(f"🤖 Solicitando respuesta a modelo {model_id}...")
+        try:
+            response = _limited(
+                lambda: (model or GenerativeModel(model_id)).generate_content(prompt),
+                est_tokens=_estimate_tokens(prompt), label="generate_text",
+            )
+            logger.debug(f"Respuesta generada ({len(response.text)} caracteres).")
+            return response.text
+        except Exception as e:
+            logger.error(f"Error al generar texto en Vertex AI: {e}")
+            raise
+
+    return _with_response_cache(model_id, prompt, [], cache_scope=cache_scope, use_cache=use_cache, call=_call)
 
 # ✅ Nuevo: pasar 1 PDF (GCS URI o varios)
-def generate_text_with_files(prompt: str, gcs_uris: list[str]) -> str:
+def generate_text_with_files(prompt: str, gcs_uris: list[str], *,
+                             model: Optional[GenerativeModel] = None,
+                             model_id: Optional[str] = None,
+                             inline_pdfs: Sequence[bytes] = (),
+                             cache_scope: str = "", use_cache: bool = True) -> str:
     """
-    Envía 'prompt' + uno o más PDFs (gs://...) como partes al modelo.
+    Envía 'prompt' + uno o más PDFs como partes al modelo: por referencia
+    (`gcs_uris`, gs://...) y/o inline (`inline_pdfs`, bytes).
     """
     init_vertex_ai()
-    model_id = settings.vertex_model_id
-    logger.info(f"🤖 Modelo {model_id} con {len(gcs_uris)} archivo(s) adjunto(s)...")
+    model_id = model_id or settings.vertex_model_id
+    n_files = len(gcs_uris) + len(inline_pdfs)
+
+    def _call() -> str:
+        logger.info(f"🤖 Modelo {model_id} con {n_files} archivo(s) adjunto(s) ({len(inline_pdfs)} inline)...")
+        try:
+            parts = [prompt] + _file_parts(gcs_uris, inline_pdfs)
+            response = _limited(
+                lambda: (model or GenerativeModel(model_id)).generate_content(parts),
+                est_tokens=_estimate_tokens(prompt, n_files), label="generate_text_with_files",
+            )
+            return response.text
+        except Exception as e:
+            logger.error(f"Error al generar texto con archivos en Vertex AI: {e}")
+            raise
+
+    return _with_response_cache(model_id, prompt, gcs_uris, cache_scope=cache_scope, use_cache=use_cache,
+                                call=_call, inline_pdfs=inline_pdfs)
+
+# --- Conteo de tokens (para planificar chunks) ---
+
+def count_tokens(text: str) -> int:
+    """Tokens de `text` según el modelo activo (llamada `countTokens`, sin generar)."""
+    init_vertex_ai()
+    model = GenerativeModel(settings.vertex_model_id)
+    return int(model.count_tokens(text).total_tokens)
+
+def count_pdf_tokens(data: bytes) -> int:
+    """Tokens de un PDF enviado inline (bytes), según el modelo activo."""
+    init_vertex_ai()
+    model = GenerativeModel(settings.vertex_model_id)
+    return int(model.count_tokens([Part.from_data(data=data, mime_type="application/pdf")]).total_tokens)
+
+# --- Streaming: fragmentos en límites de párrafo ---
+
+def _iter_paragraphs(responses: Iterable) -> Iterator[str]:
+    """Reagrupa los fragmentos del stream y los emite cortando en párrafos (\n\n)."""
+    buf = ""
+    for resp in responses:
+        try:
+            text = resp.text
+        except ValueError:
+            continue  # fragmento sin texto (p. ej. solo finish_reason)
+        buf += text or ""
+        cut = buf.rfind("\n\n")
+        if cut != -1:
+            yield buf[:cut + 2]
+            buf = buf[cut + 2:]
+    if buf:
+        yield buf
+
+def stream_text(prompt: str, *, model: Optional[GenerativeModel] = None,
+                model_id: Optional[str] = None,
+                cache_scope: str = "", use_cache: bool = True) -> Iterator[str]:
+    """Como `generate_text`, pero va entregando el texto por párrafos según se genera."""
+    init_vertex_ai()
+    model_id = model_id or settings.vertex_model_id
+
+    def _call() -> Iterator[str]:
+        logger.info(f"🤖 Solicitando respuesta en streaming a modelo {model_id}...")
+        try:
+            responses = _limited(
+                lambda: _start_stream(lambda: (model or GenerativeModel(model_id)).generate_content(prompt, stream=True)),
+                est_tokens=_estimate_tokens(prompt), label="stream_text",
+            )
+            yield from _iter_paragraphs(responses)
+        except Exception as e:
+            logger.error(f"Error en streaming de Vertex AI: {e}")
+            raise
+
+    yield from _stream_with_response_cache(model_id, prompt, [], cache_scope=cache_scope,
+                                           use_cache=use_cache, call=_call)
+
+def stream_text_with_files(prompt: str, gcs_uris: list[str], *,
+                           model: Optional[GenerativeModel] = None,
+                           model_id: Optional[str] = None,
+                           inline_pdfs: Sequence[bytes] = (),
+                           cache_scope: str = "", use_cache: bool = True) -> Iterator[str]:
+    """Como `generate_text_with_files`, pero en streaming por párrafos."""
+    init_vertex_ai()
+    model_id = model_id or settings.vertex_model_id
+    n_files = len(gcs_uris) + len(inline_pdfs)
+
+    def _call() -> Iterator[str]:
+        logger.info(f"🤖 Modelo {model_id} (streaming) con {n_files} archivo(s) adjunto(s) "
+                    f"({len(inline_pdfs)} inline)...")
+        parts = [prompt] + _file_parts(gcs_uris, inline_pdfs)
+        try:
+            responses = _limited(
+                lambda: _start_stream(lambda: (model or GenerativeModel(model_id)).generate_content(parts, stream=True)),
+                est_tokens=_estimate_tokens(prompt, n_files), label="stream_text_with_files",
+            )
+            yield from _iter_paragraphs(responses)
+        except Exception as e:
+            logger.error(f"Error en streaming con archivos en Vertex AI: {e}")
+            raise
+
+    yield from _stream_with_response_cache(model_id, prompt, gcs_uris, cache_scope=cache_scope,
+                                           use_cache=use_cache, call=_call, inline_pdfs=inline_pdfs)
+
+# --- Prefijo compartido (system + base) con context caching ---
+
+def _local_prefix_ttl_s(server_ttl_s: float) -> float:
+    """
+    TTL local algo menor que el del CachedContent en Vertex, para no usar uno
+    ya expirado: margen del 10 % (máx. 5 min), nunca por encima del servidor.
+    """
+    return max(0.0, server_ttl_s - min(300.0, server_ttl_s * 0.1))
+
+_prefix_models: TTLCache[GenerativeModel] = TTLCache(
+    max_entries=32,
+    ttl_s=_local_prefix_ttl_s(settings.vertex_context_cache_ttl_s),
+)
+register_metrics("vertex_prefix_cache", _prefix_models.stats)
+# Un lock por clave: solo esperan el create quienes piden el mismo prefijo
+_prefix_locks: Dict[Tuple[str, str], threading.Lock] = {}
+_prefix_locks_guard = threading.Lock()
+
+def _prefix_instruction(system_text: str, base_prompt: str) -> str:
+    return f"[SYSTEM]\n{system_text}\n\n[PROMPT_BASE]\n{base_prompt}\n"
+
+def _prefix_digest(system_text: str, base_prompt: str) -> str:
+    return hashlib.sha256(_prefix_instruction(system_text, base_prompt).encode("utf-8")).hexdigest()
+
+def _create_prefix_model(model_id: str, instruction: str, digest: str) -> GenerativeModel:
+    if settings.vertex_context_cache_enabled:
+        try:
+            cached = caching.CachedContent.create(
+                model_name=model_id,
+                system_instruction=instruction,
+                ttl=timedelta(seconds=settings.vertex_context_cache_ttl_s),
+                display_name=f"brain-prefix-{digest[:12]}",
+            )
+            logger.info(f"🧊 Context cache creado para el prefijo system+base ({cached.name}).")
+            return GenerativeModel.from_cached_content(cached_content=cached)
+        except Exception as e:
+            # p. ej. prefijo por debajo del mínimo de tokens cacheables
+            logger.info(f"Context cache no disponible ({e.__class__.__name__}: {e}); uso system_instruction.")
+    return GenerativeModel(model_id, system_instruction=instruction)
+
+def get_prefix_model(system_text: str, base_prompt: str, *,
+                     prefix_key: Optional[str] = None,
+                     model_id: Optional[str] = None) -> GenerativeModel:
+    """
+    Devuelve un modelo con el prefijo system+base ya cargado, reutilizable
+    entre chunks, reduce y jobs que comparten los mismos Docs de prompt:
+    1) `CachedContent` de Vertex (el prefijo se tokeniza una sola vez), o
+    2) `GenerativeModel(system_instruction=...)` si el caché no aplica.
+    `prefix_key` identifica las revisiones de los Docs; si falta, se usa un hash del texto.
+    """
+    init_vertex_ai()
+    model_id = model_id or settings.vertex_model_id
+    instruction = _prefix_instruction(system_text, base_prompt)
+    digest = _prefix_digest(system_text, base_prompt)
+    key = (model_id, prefix_key or digest)
+
+    model = _prefix_models.get(key)
+    if model is not None:
+        return model
+    with _prefix_locks_guard:
+        lock = _prefix_locks.setdefault(key, threading.Lock())
     try:
-        model = GenerativeModel(model_id)
-        parts = [prompt] + [Part.from_uri(uri, mime_type="application/pdf") for uri in gcs_uris]
-        response = model.generate_content(parts)
-        return response.text
-    except Exception as e:
-        logger.error(f"Error al generar texto con archivos en Vertex AI: {e}")
-        raise
-
-# ✅ Nuevo: patrón Map-Reduce para PDFs grandes
-def generate_text_from_files_map_reduce(system_text: str, base_prompt: str,
-                                        chunk_uris: list[str], params: dict) -> str:
+        with lock:  # un solo create por clave aunque haya chunks concurrentes
+            model = _prefix_models.get(key)
+            if model is None:
+                model = _create_prefix_model(model_id, instruction, digest)
+                _prefix_models.put(key, model)
+    finally:
+        with _prefix_locks_guard:
+            if _prefix_locks.get(key) is lock:
+                del _prefix_locks[key]  # quien ya lo esperaba lo conserva; luego es un hit
+    return model
+
+def _run_concurrently(
+    tasks: List[Callable[[], str]],
+    *,
+    concurrency: int,
+    max_retries: int,
+    label: str,
+) -> List[str]:
     """
-    MAP: procesa cada chunk por separado (adjuntando su PDF).
-    REDUCE: consolida todos los parciales en una sola salida.
+    Ejecuta `tasks` en un pool acotado y devuelve los resultados EN ORDEN.
+    Si alguna falla, reintenta solo las fallidas (backoff + jitter) hasta
+    `max_retries` veces; si siguen fallando, lanza RuntimeError.
+    Los 429 y errores transitorios no se reintentan aquí: ya agotaron los
+    reintentos del limitador compartido (una sola capa de reintentos).
+    """
+    results: List[Optional[str]] = [None] * len(tasks)
+    pending = list(range(len(tasks)))
+    delay = 2.0
+    for attempt in range(max_retries + 1):
+        errors: Dict[int, Exception] = {}
+        workers = max(1, min(concurrency, len(pending)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=label) as pool:
+            futures = {pool.submit(tasks[i]): i for i in pending}
+            for fut in as_completed(futures):
+                i = futures[fut]
+                try:
+                    results[i] = fut.result()
+                except Exception as e:
+                    errors[i] = e
+                    logger.warning(f"⚠️ {label} {i + 1}/{len(tasks)} falló (intento {attempt + 1}): {e}")
+        if not errors:
+            break
+        pending = sorted(errors)
+        exhausted = [i for i in pending if is_rate_limited(errors[i]) or is_transient(errors[i])]
+        if exhausted or attempt == max_retries:
+            raise RuntimeError(
+                f"{label}: {len(pending)} parte(s) fallaron tras {attempt + 1} intento(s): "
+                f"{[i + 1 for i in pending]}"
+            ) from errors[(exhausted or pending)[0]]
+        sleep = delay + random.uniform(0, delay * 0.5)
+        logger.info(f"🔁 {label}: reintentando {len(pending)} parte(s) en {sleep:.1f}s…")
+        time.sleep(sleep)
+        delay = min(delay * 2, 30)
+    return [r or "" for r in results]
+
+# ✅ Nuevo: patrón Map-Reduce para PDFs grandes (y textos largos)
+@dataclass(frozen=True)
+class MapChunk:
+    """Una parte del MAP: un PDF en GCS (`uri`), un PDF inline (`data`) o un fragmento de texto (`text`)."""
+    uri: Optional[str] = None
+    text: Optional[str] = None
+    data: Optional[bytes] = None
+
+_FINAL_REDUCE_INSTRUCTION = (
+    "Instrucción: Fusiona y deduplica los resultados anteriores en una sola salida final, "
+    "respetando formato y criterios de PROMPT_BASE/PARAMS. No inventes."
+)
+_PARTIAL_REDUCE_INSTRUCTION = (
+    "Instrucción: Fusiona y deduplica los resultados anteriores en una salida intermedia que "
+    "conserve todos los hallazgos y referencias (será combinada con otras). No inventes."
+)
+
+def _reduce_prompt(partials: list[str], instruction: str) -> str:
+    return f"[PARTIALS]\n" + "\n\n".join(partials) + "\n\n" + instruction
+
+def _tree_reduce(model: GenerativeModel, model_id: str, partials: list[str], scope: str, use_cache: bool) -> str:
+    """
+    REDUCE jerárquico: mientras haya más de `vertex_reduce_fan_in` parciales,
+    los fusiona por grupos (en paralelo, orden determinista) y sube un nivel.
+    Devuelve el prompt del REDUCE final, con a lo sumo `fan_in` parciales:
+    la latencia crece con log(chunks) y los prompts quedan acotados.
+    """
+    fan_in = max(2, settings.vertex_reduce_fan_in)
+    level = 1
+    while len(partials) > fan_in:
+        groups = [partials[i:i + fan_in] for i in range(0, len(partials), fan_in)]
+
+        def _reduce_task(group: list[str]) -> Callable[[], str]:
+            if len(group) == 1:
+                return lambda: group[0]
+            prompt = _reduce_prompt(group, _PARTIAL_REDUCE_INSTRUCTION)
+            return lambda: generate_text(prompt, model=model, model_id=model_id,
+                                         cache_scope=scope, use_cache=use_cache)
+
+        t0 = time.perf_counter()
+        outputs = _run_concurrently(
+            [_reduce_task(g) for g in groups],
+            concurrency=settings.vertex_map_concurrency,
+            max_retries=settings.vertex_map_max_retries,
+            label=f"reduce_l{level}",
+        )
+        logger.info(f"🌲 REDUCE nivel {level}: {len(partials)} → {len(groups)} parcial(es) "
+                    f"en {time.perf_counter() - t0:.1f}s (fan-in={fan_in}).")
+        partials = [f"### GRUPO {level}.{k}\n{out}" for k, out in enumerate(outputs, start=1)]
+        level += 1
+    return _reduce_prompt(partials, _FINAL_REDUCE_INSTRUCTION)
+
+def _map_chunks(system_text: str, base_prompt: str, chunks: list[MapChunk], params: dict,
+                prefix_key: Optional[str], use_cache: bool) -> tuple[GenerativeModel, str, str, str]:
     """
-    partials: list[str] = []
-    total = len(chunk_uris)
+    MAP: procesa cada chunk por separado (adjuntando su PDF o su texto), en paralelo
+         con concurrencia acotada (`vertex_map_concurrency`) y orden determinista.
+    Después reduce por niveles (`_tree_reduce`) hasta dejar un solo REDUCE final.
+    MAP y REDUCE pueden usar modelos distintos (ver `select_model`).
+    Devuelve el modelo de REDUCE (con el prefijo cacheado) y su id, el prompt del
+    REDUCE final y el `cache_scope` (hash del prefijo) para la caché de respuestas.
+    """
+    init_vertex_ai()  # antes del pool: evita inicializaciones concurrentes
+    map_model_id = select_model("map")
+    reduce_model_id = select_model("reduce")
+    model = get_prefix_model(system_text, base_prompt, prefix_key=prefix_key, model_id=map_model_id)
+    reduce_model = get_prefix_model(system_text, base_prompt, prefix_key=prefix_key, model_id=reduce_model_id)
+    scope = _prefix_digest(system_text, base_prompt)
+    total = len(chunks)
 
-    for i, uri in enumerate(chunk_uris, start=1):
+    def _map_task(i: int, chunk: MapChunk) -> Callable[[], str]:
+        if chunk.uri or chunk.data:
+            sub_prompt = (
+                f"[INPUT_CHUNK {i}/{total}]\n(Usa ÚNICAMENTE el PDF adjunto en esta parte)\n\n"
+                f"[PARAMS]\n{params}\n"
+            )
+            uris = [chunk.uri] if chunk.uri else []
+            inline = [chunk.data] if chunk.data else []
+            return lambda: generate_text_with_files(sub_prompt, uris, model=model, model_id=map_model_id,
+                                                    inline_pdfs=inline, cache_scope=scope, use_cache=use_cache)
         sub_prompt = (
-            f"[SYSTEM]\n{system_text}\n\n"
-            f"[PROMPT_BASE]\n{base_prompt}\n\n"
-            f"[INPUT_CHUNK {i}/{total}]\n(Usa ÚNICAMENTE el PDF adjunto en esta parte)\n\n"
+            f"[INPUT_CHUNK {i}/{total}]\n{(chunk.text or '').strip()}\n\n"
             f"[PARAMS]\n{params}\n"
         )
-        partial = generate_text_with_files(sub_prompt, [uri])
-        partials.append(f"### CHUNK {i}\n{partial}")
-
-    reduce_prompt = (
-        f"[SYSTEM]\n{system_text}\n\n"
-        f"[PROMPT_BASE]\n{base_prompt}\n\n"
-        f"[PARTIALS]\n" + "\n\n".join(partials) + "\n\n"
-        "Instrucción: Fusiona y deduplica los resultados anteriores en una sola salida final, "
-        "respetando formato y criterios de PROMPT_BASE/PARAMS. No inventes."
+        return lambda: generate_text(sub_prompt, model=model, model_id=map_model_id,
+                                     cache_scope=scope, use_cache=use_cache)
+
+    t0 = time.perf_counter()
+    outputs = _run_concurrently(
+        [_map_task(i, chunk) for i, chunk in enumerate(chunks, start=1)],
+        concurrency=settings.vertex_map_concurrency,
+        max_retries=settings.vertex_map_max_retries,
+        label="map_chunk",
     )
-    return generate_text(reduce_prompt)
+    logger.info(f"🗺️ MAP de {total} chunk(s) en {time.perf_counter() - t0:.1f}s "
+                f"(concurrencia={settings.vertex_map_concurrency}).")
+    partials = [f"### CHUNK {i}\n{out}" for i, out in enumerate(outputs, start=1)]
+    final_prompt = _tree_reduce(reduce_model, reduce_model_id, partials, scope, use_cache)
+    return reduce_model, reduce_model_id, final_prompt, scope
+
+def generate_text_map_reduce(system_text: str, base_prompt: str,
+                             chunks: list[MapChunk], params: dict, *,
+                             prefix_key: Optional[str] = None,
+                             use_cache: bool = True) -> str:
+    """
+    MAP: procesa cada chunk por separado.
+    REDUCE: consolida todos los parciales en una sola salida.
+    El prefijo system+base va en un modelo con context caching (ver `get_prefix_model`),
+    así que cada prompt solo envía su parte variable.
+    """
+    model, model_id, reduce_prompt, scope = _map_chunks(system_text, base_prompt, chunks, params,
+                                                        prefix_key, use_cache)
+    return generate_text(reduce_prompt, model=model, model_id=model_id, cache_scope=scope, use_cache=use_cache)
+
+def stream_text_map_reduce(system_text: str, base_prompt: str,
+                           chunks: list[MapChunk], params: dict, *,
+                           prefix_key: Optional[str] = None,
+                           use_cache: bool = True) -> Iterator[str]:
+    """Como `generate_text_map_reduce`, pero el REDUCE sale en streaming."""
+    model, model_id, reduce_prompt, scope = _map_chunks(system_text, base_prompt, chunks, params,
+                                                        prefix_key, use_cache)
+    yield from stream_text(reduce_prompt, model=model, model_id=model_id, cache_scope=scope, use_cache=use_cache)
+
+def generate_text_from_files_map_reduce(system_text: str, base_prompt: str,
+                                        chunk_uris: list[str], params: dict, *,
+                                        prefix_key: Optional[str] = None,
+                                        use_cache: bool = True) -> str:
+    """Map-Reduce sobre PDFs en GCS (un chunk por URI)."""
+    return generate_text_map_reduce(system_text, base_prompt, [MapChunk(uri=u) for u in chunk_uris], params,
+                                    prefix_key=prefix_key, use_cache=use_cache)
+
+def stream_text_from_files_map_reduce(system_text: str, base_prompt: str,
+                                      chunk_uris: list[str], params: dict, *,
+                                      prefix_key: Optional[str] = None,
+                                      use_cache: bool = True) -> Iterator[str]:
+    """Como `generate_text_from_files_map_reduce`, pero el REDUCE sale en streaming."""
+    yield from stream_text_map_reduce(system_text, base_prompt, [MapChunk(uri=u) for u in chunk_uris], params,
+                                      prefix_key=prefix_key, use_cache=use_cache)
@@ -3,8 +3,10 @@ from fastapi import FastAPI
 from src.api.routes import router as api_router
 from src.api.health import router as health_router
 from src.api.whoami import router as whoami_router
+from src.api.metrics import router as metrics_router
 
 app = FastAPI(title="AI Doc Processor API")
 app.include_router(api_router)
 app.include_router(health_router)
 app.include_router(whoami_router)
+app.include_router(metrics_router)
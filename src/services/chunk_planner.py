@@ -0,0 +1,166 @@
+# src/services/chunk_planner.py
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from io import BytesIO
+from typing import BinaryIO, List, Optional
+
+from PyPDF2 import PdfReader, PdfWriter
+
+from src.clients.vertex_client import count_pdf_tokens, count_tokens
+from src.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Límite de páginas por archivo PDF que acepta Gemini
+_MAX_PAGES_PER_FILE = 1000
+# Heurística si countTokens falla: ~4 caracteres por token
+_CHARS_PER_TOKEN_FALLBACK = 4.0
+
+
+@dataclass
+class ChunkPlan:
+    """Decisión single-shot vs map-reduce y tamaño de chunk, según presupuesto de tokens."""
+    mode: str                               # "single" | "map_reduce"
+    total_tokens: int
+    chunk_count: int = 1
+    pages_per_chunk: Optional[int] = None   # PDFs
+    chars_per_chunk: Optional[int] = None   # texto
+    estimated: bool = False                 # True si los tokens salen de una muestra/heurística
+    reason: str = ""
+
+    @property
+    def map_reduce(self) -> bool:
+        return self.mode == "map_reduce"
+
+    def log(self, label: str) -> None:
+        size = (
+            f"pages/chunk={self.pages_per_chunk}" if self.pages_per_chunk is not None
+            else f"chars/chunk={self.chars_per_chunk}"
+        )
+        logger.info(
+            f"🧭 Plan {label}: mode={self.mode} tokens={self.total_tokens}"
+            f"{' (estimado)' if self.estimated else ''} chunks={self.chunk_count} {size} "
+            f"| budget={settings.plan_single_shot_max_tokens} target={settings.plan_target_chunk_tokens} "
+            f"| {self.reason}"
+        )
+
+
+# ---------- PDFs ----------
+
+def _sample_pdf(reader: PdfReader, sample_pages: int) -> bytes:
+    """PDF pequeño con `sample_pages` páginas repartidas uniformemente por el documento."""
+    n = len(reader.pages)
+    step = n / sample_pages
+    w = PdfWriter()
+    for k in range(sample_pages):
+        w.add_page(reader.pages[min(n - 1, int(k * step))])
+    out = BytesIO()
+    w.write(out)
+    return out.getvalue()
+
+
+def _overhead_tokens(overhead: str) -> int:
+    """Tokens del resto del prompt (system/base/params): countTokens, o ~4 chars/token si falla."""
+    if not overhead:
+        return 0
+    try:
+        return count_tokens(overhead)
+    except Exception as e:
+        logger.warning(f"countTokens del prompt falló ({e.__class__.__name__}: {e}); estimo por caracteres.")
+        return math.ceil(len(overhead) / _CHARS_PER_TOKEN_FALLBACK)
+
+
+def plan_pdf(reader: PdfReader, source: BinaryIO, size: int, *, overhead: str = "") -> ChunkPlan:
+    """
+    Cuenta tokens del PDF (entero si es pequeño; si no, sobre una muestra de
+    páginas repartidas) y decide single-shot vs map-reduce contra
+    `plan_single_shot_max_tokens`, dimensionando los chunks para acercarse a
+    `plan_target_chunk_tokens`. Si countTokens falla, cae al corte por páginas.
+    `source` (el archivo del reader) solo se lee entero si es pequeño.
+    `overhead` es el resto del prompt (system/base/params) que acompaña al PDF
+    en single-shot; cuenta contra el presupuesto igual que en `plan_text`.
+    """
+    n = len(reader.pages)
+    sample = max(1, settings.plan_sample_pages)
+    try:
+        if n <= sample and size <= settings.plan_inline_count_max_bytes:
+            source.seek(0)
+            total = count_pdf_tokens(source.read())
+            estimated = False
+        else:
+            sampled = min(n, sample)
+            total = math.ceil(count_pdf_tokens(_sample_pdf(reader, sampled)) / sampled * n)
+            estimated = True
+    except Exception as e:
+        logger.warning(f"countTokens falló ({e.__class__.__name__}: {e}); plan por páginas.")
+        ppc = max(5, settings.pdf_max_pages_per_chunk)
+        if n <= settings.pdf_max_pages_per_chunk:
+            return ChunkPlan("single", 0, pages_per_chunk=n, estimated=True, reason="fallback por páginas")
+        return ChunkPlan("map_reduce", 0, chunk_count=math.ceil(n / ppc), pages_per_chunk=ppc,
+                         estimated=True, reason="fallback por páginas")
+
+    tokens_per_page = max(1.0, total / max(1, n))
+    extra = _overhead_tokens(overhead)
+    if total + extra <= settings.plan_single_shot_max_tokens and n <= _MAX_PAGES_PER_FILE:
+        return ChunkPlan("single", total + extra, pages_per_chunk=n, estimated=estimated,
+                         reason=f"{tokens_per_page:.0f} tokens/página + {extra} de prompt")
+    ppc = int(settings.plan_target_chunk_tokens // tokens_per_page)
+    ppc = max(1, min(ppc, _MAX_PAGES_PER_FILE, n))
+    return ChunkPlan("map_reduce", total + extra, chunk_count=math.ceil(n / ppc), pages_per_chunk=ppc,
+                     estimated=estimated, reason=f"{tokens_per_page:.0f} tokens/página + {extra} de prompt")
+
+
+# ---------- Texto ----------
+
+def plan_text(input_text: str, *, overhead: str = "") -> ChunkPlan:
+    """
+    Igual que `plan_pdf` para entradas de texto. `overhead` es el resto del
+    prompt (system/base/params) que acompaña a la entrada en single-shot.
+    Si el total de caracteres ya cabe en el presupuesto (1 token ≥ 1 carácter)
+    no se llama a countTokens.
+    """
+    budget = settings.plan_single_shot_max_tokens
+    full_chars = len(overhead) + len(input_text)
+    if full_chars <= budget:
+        return ChunkPlan("single", math.ceil(full_chars / _CHARS_PER_TOKEN_FALLBACK), estimated=True,
+                         chars_per_chunk=len(input_text), reason="cabe por número de caracteres")
+    try:
+        total = count_tokens(overhead + input_text)
+        estimated = False
+    except Exception as e:
+        logger.warning(f"countTokens falló ({e.__class__.__name__}: {e}); estimo por caracteres.")
+        total = math.ceil(full_chars / _CHARS_PER_TOKEN_FALLBACK)
+        estimated = True
+
+    chars_per_token = full_chars / max(1, total)
+    if total <= budget:
+        return ChunkPlan("single", total, chars_per_chunk=len(input_text), estimated=estimated,
+                         reason=f"{chars_per_token:.1f} chars/token")
+    cpc = max(1_000, int(settings.plan_target_chunk_tokens * chars_per_token))
+    return ChunkPlan("map_reduce", total, chunk_count=math.ceil(len(input_text) / cpc), chars_per_chunk=cpc,
+                     estimated=estimated, reason=f"{chars_per_token:.1f} chars/token")
+
+
+def split_text(text: str, chars_per_chunk: int) -> List[str]:
+    """Parte `text` en trozos de ~`chars_per_chunk` cortando en saltos de línea."""
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        while len(line) > chars_per_chunk:  # línea gigante: corte duro
+            if current:
+                chunks.append("".join(current))
+                current, size = [], 0
+            chunks.append(line[:chars_per_chunk])
+            line = line[chars_per_chunk:]
+        if size + len(line) > chars_per_chunk and current:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        chunks.append("".join(current))
+    return chunks
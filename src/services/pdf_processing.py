@@ -1,48 +1,57 @@
 # src/services/pdf_processing.py
 from __future__ import annotations
-from typing import Dict, List
-from io import BytesIO
+import time
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
-from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2 import PdfReader
 
-from src.clients.gdocs_client import get_document_content, write_to_document
-from src.clients.vertex_client import generate_text_with_files, generate_text_from_files_map_reduce
+from src.clients.gdocs_client import (
+    get_cached_document_content, get_document_revisions, write_stream_to_document, write_to_document
+)
+from src.clients.vertex_client import (
+    MapChunk, generate_text, generate_text_map_reduce, generate_text_with_files, select_model,
+    stream_text, stream_text_map_reduce, stream_text_with_files,
+)
 from src.clients.drive_client import (
-    assert_sa_has_access, parse_drive_url_to_id, download_file_bytes
+    SpooledDownload, check_file_access, download_file_spooled, parse_drive_url_to_id,
 )
-from src.clients.gcs_client import upload_bytes
+from src.clients.gcs_client import GCSObjectFile, open_object
+from src.services.prefetch import prefetch
+from src.services.chunk_planner import plan_pdf, plan_text, split_text
+from src.services.pdf_split import page_ranges
+from src.services.pdf_staging import stage_drive_pdf, stage_pdf, stage_pdf_ranges
+from src.services.pdf_text import SCAN, TEXT, TextLayer, get_text_layer
+from src.services.processing import build_prompt, prefix_key_for, split_cache_flag
 from src.utils.logger import get_logger
 from src.settings import settings
 
 logger = get_logger(__name__)
 
-def _split_pdf_bytes(data: bytes, pages_per_chunk: int) -> List[bytes]:
-    reader = PdfReader(BytesIO(data))
-    n = len(reader.pages)
-    if n <= pages_per_chunk:
-        return [data]
-    chunks: List[bytes] = []
-    for start in range(0, n, pages_per_chunk):
-        end = min(start + pages_per_chunk, n)
-        w = PdfWriter()
-        for i in range(start, end):
-            w.add_page(reader.pages[i])
-        out = BytesIO()
-        w.write(out)
-        chunks.append(out.getvalue())
-    return chunks
+# PDF abierto para leer: descargado de Drive (spooled) o en GCS (lectura por rangos)
+PdfSource = Union[SpooledDownload, GCSObjectFile]
 
-def _to_gcs_chunks(data: bytes) -> List[str]:
-    if not settings.pdf_staging_bucket:
-        raise RuntimeError("Falta PDF_STAGING_BUCKET en configuración.")
-    pages_per_chunk = max(5, settings.pdf_max_pages_per_chunk)
-    reader = PdfReader(BytesIO(data))
-    if len(reader.pages) <= pages_per_chunk:
-        return [upload_bytes(settings.pdf_staging_bucket, data, suffix=".pdf")]
-    uris: List[str] = []
-    for chunk in _split_pdf_bytes(data, pages_per_chunk):
-        uris.append(upload_bytes(settings.pdf_staging_bucket, chunk, suffix=".pdf"))
-    return uris
+# Tope de una petición a Vertex con datos inline: 20 MB (decimales) en total,
+# PDF + prompt. Se deja margen para el sobre de la petición y el prompt del chunk.
+_INLINE_REQUEST_MAX_BYTES = 20_000_000
+_INLINE_REQUEST_HEADROOM_BYTES = 2_000_000
+
+def _fetch_drive_pdf(file_id: str) -> PdfSource:
+    """
+    Abre un PDF de Drive. Lo que no cabe en `pdf_spool_max_memory_bytes` se
+    vuelca a `pdf_spool_dir` (volumen montado); si no hay volumen, va directo
+    de Drive a staging en GCS y se lee por rangos: en Cloud Run /tmp es
+    memoria y un PDF grande en /tmp cuenta entero contra el límite.
+    """
+    meta = check_file_access(file_id, use_docs_api=False)  # archivo binario → Drive API
+    size = int(meta.get("size") or 0) or None
+    if size and size > settings.pdf_spool_max_memory_bytes and not settings.pdf_spool_dir:
+        if not settings.pdf_staging_bucket:
+            raise RuntimeError(
+                f"PDF de {size / 1e6:.1f} MB (> PDF_SPOOL_MAX_MEMORY_BYTES): configura PDF_SPOOL_DIR "
+                f"(volumen montado) o PDF_STAGING_BUCKET; /tmp en Cloud Run es memoria."
+            )
+        return stage_drive_pdf(file_id)
+    return download_file_spooled(file_id, size=size)
 
 def build_prompt_for_pdf(system_text: str, base_prompt: str, params: Dict[str, object]) -> str:
     parts = []
@@ -55,6 +64,103 @@ def build_prompt_for_pdf(system_text: str, base_prompt: str, params: Dict[str, o
     parts.append("Usa únicamente el/los PDF(s) adjunto(s) como fuente. No inventes.")
     return "\n".join(parts).strip()
 
+def _mixed_chunks(reader: PdfReader, pdf: PdfSource, layer: TextLayer,
+                  pages_per_chunk: int) -> List[MapChunk]:
+    """
+    Chunks en orden de páginas: los tramos con capa de texto van como texto
+    plano (troceados por presupuesto de tokens) y solo los escaneados como PDF.
+    """
+    runs = layer.runs()
+    text_all = "\n\n".join(layer.text_of(a, b) for kind, a, b in runs if kind == TEXT)
+    chars_per_chunk = plan_text(text_all).chars_per_chunk or len(text_all)
+    scan_ranges = [r for kind, a, b in runs if kind == SCAN for r in page_ranges(a, b, pages_per_chunk)]
+    scan_uris = iter(stage_pdf_ranges(reader, pdf.file, pdf.sha256, scan_ranges))
+
+    chunks: List[MapChunk] = []
+    for kind, a, b in runs:
+        if kind == TEXT:
+            chunks += [MapChunk(text=t) for t in split_text(layer.text_of(a, b), chars_per_chunk)]
+        else:
+            chunks += [MapChunk(uri=next(scan_uris)) for _ in page_ranges(a, b, pages_per_chunk)]
+    logger.info(f"🧩 Chunks mixtos: {len(chunks) - len(scan_ranges)} de texto + {len(scan_ranges)} PDF (escaneados).")
+    return chunks
+
+def _attach_inline(size: int, prompt: str) -> bool:
+    """
+    PDF pequeño → inline (`Part.from_data`), sin staging en GCS. Con
+    `pdf_use_file_api` el corte es `pdf_inline_max_bytes`; sin él, todo lo que
+    quepa en la petición junto con `prompt` (20 MB menos el prompt y un
+    margen de 2 MB: ~18 MB con prompts normales).
+    """
+    budget = _INLINE_REQUEST_MAX_BYTES - _INLINE_REQUEST_HEADROOM_BYTES - len(prompt.encode("utf-8"))
+    limit = settings.pdf_inline_max_bytes if settings.pdf_use_file_api else budget
+    return size <= min(limit, budget)
+
+def _plan_pdf_source(pdf: PdfSource, *, overhead: str) -> Tuple[List[MapChunk], Optional[int]]:
+    """
+    Un único parseo (perezoso, sobre el archivo) para decidir cómo viaja el PDF.
+    Devuelve los chunks del job (uno solo = single-shot) y los tokens de
+    entrada si se conocen (para el ruteo de modelo). Un PDF que ya está en
+    GCS y cabe en single-shot se adjunta tal cual, sin copiarlo a staging.
+    """
+    reader = PdfReader(pdf.file)
+    n_pages = len(reader.pages)
+    layer = get_text_layer(pdf.file, pdf.sha256) if settings.pdf_text_fast_path else None
+
+    # 1. Todas las páginas con capa de texto → texto plano, sin procesar el PDF
+    if layer is not None and layer.scanned_pages == 0:
+        text = layer.text_of(0, n_pages)
+        plan = plan_text(text, overhead=overhead)
+        plan.log("process_pdf[texto]")
+        if not plan.map_reduce:
+            return [MapChunk(text=text)], plan.total_tokens
+        return [MapChunk(text=t) for t in split_text(text, plan.chars_per_chunk or len(text))], plan.total_tokens
+
+    # 2. Hay páginas escaneadas → plan sobre el PDF
+    plan = plan_pdf(reader, pdf.file, pdf.size, overhead=overhead)
+    plan.log("process_pdf")
+    input_tokens = plan.total_tokens or None  # 0 = fallback por páginas
+    pages_per_chunk = plan.pages_per_chunk or n_pages
+    if plan.map_reduce:
+        logger.info(f"📚 PDF grande ({n_pages} páginas). Map-Reduce activado.")
+        # Mixto: solo los tramos escaneados viajan como PDF
+        if layer is not None and layer.scanned_pages < n_pages:
+            return _mixed_chunks(reader, pdf, layer, pages_per_chunk), input_tokens
+
+    if isinstance(pdf, GCSObjectFile) and not plan.map_reduce:
+        return [MapChunk(uri=pdf.uri)], input_tokens
+
+    t0 = time.perf_counter()
+    if not plan.map_reduce and _attach_inline(pdf.size, overhead):
+        pdf.file.seek(0)
+        data = pdf.file.read()
+        logger.info(f"📎 PDF inline ({pdf.size / 1e6:.1f} MB): sin staging en GCS "
+                    f"({time.perf_counter() - t0:.2f}s).")
+        return [MapChunk(data=data)], input_tokens
+    uris = stage_pdf(reader, pdf.file, pdf.sha256, pdf.size, pages_per_chunk)
+    logger.info(f"📎 PDF por referencia GCS ({pdf.size / 1e6:.1f} MB, {len(uris)} objeto(s)): "
+                f"staging en {time.perf_counter() - t0:.2f}s.")
+    return [MapChunk(uri=u) for u in uris], input_tokens
+
+def _generate(chunks: List[MapChunk], *, system_text: str, base_prompt: str, params: Dict[str, object],
+              prefix_key: Optional[str], input_tokens: Optional[int], use_cache: bool,
+              stream: bool) -> Union[str, Iterator[str]]:
+    """Single-shot (un chunk: PDF adjunto o texto) o Map-Reduce; en streaming si `stream`."""
+    if len(chunks) > 1:
+        run = stream_text_map_reduce if stream else generate_text_map_reduce
+        return run(system_text, base_prompt, chunks, params, prefix_key=prefix_key, use_cache=use_cache)
+
+    chunk = chunks[0]
+    model_id = select_model("single", input_tokens=input_tokens)
+    if chunk.uri or chunk.data:
+        prompt = build_prompt_for_pdf(system_text, base_prompt, params)
+        run_files = stream_text_with_files if stream else generate_text_with_files
+        return run_files(prompt, [chunk.uri] if chunk.uri else [], model_id=model_id,
+                         inline_pdfs=[chunk.data] if chunk.data else [], use_cache=use_cache)
+    prompt = build_prompt(system_text, base_prompt, chunk.text or "", params)
+    run_text = stream_text if stream else generate_text
+    return run_text(prompt, model_id=model_id, use_cache=use_cache)
+
 def process_pdf_documents(
     *,
     system_instructions_doc_id: str,
@@ -65,45 +171,65 @@ def process_pdf_documents(
     additional_params: Dict[str, object] = {},
 ) -> dict:
     logger.info("🚀 Iniciando proceso (PDF → Gemini → Doc)...")
+    additional_params, use_cache = split_cache_flag(additional_params)
 
-    # Pre-check de acceso a Docs (system/base/output)
-    for fid in (system_instructions_doc_id, base_prompt_doc_id, output_doc_id):
-        assert_sa_has_access(fid)
-
-    system_text = get_document_content(system_instructions_doc_id)
-    base_prompt = get_document_content(base_prompt_doc_id)
-
-    # Resolver a gs://
-    gs_uris: List[str]
-    if pdf_url.startswith("gs://"):
-        gs_uris = [pdf_url]
-        bytes_local = None
-    else:
+    # Resolver origen del PDF (Drive → se descarga; gs:// → se lee por rangos)
+    fid: str | None = None
+    if not pdf_url.startswith("gs://"):
         fid = drive_file_id or parse_drive_url_to_id(pdf_url)
         if not fid:
             raise ValueError("pdf_url no es gs:// y no se pudo extraer drive_file_id.")
-        assert_sa_has_access(fid, use_docs_api=False)  # archivo binario → Drive API
-        bytes_local = download_file_bytes(fid)
-        if not settings.pdf_staging_bucket:
-            raise RuntimeError("Falta PDF_STAGING_BUCKET en configuración.")
-        # chunking si es grande
-        reader = PdfReader(BytesIO(bytes_local))
-        if len(reader.pages) > settings.pdf_max_pages_per_chunk:
-            logger.info(f"📚 PDF grande ({len(reader.pages)} páginas). Map-Reduce activado.")
-            gs_uris = _to_gcs_chunks(bytes_local)
-        else:
-            gs_uris = [upload_bytes(settings.pdf_staging_bucket, bytes_local, suffix=".pdf")]
 
-    prompt_text = build_prompt_for_pdf(system_text, base_prompt, additional_params)
+    # Acceso a system/base/output en un solo batch (máscara mínima),
+    # en paralelo con la apertura del PDF
+    tasks = {
+        "revisions": lambda: get_document_revisions(
+            (system_instructions_doc_id, base_prompt_doc_id, output_doc_id)
+        ),
+        "pdf": (lambda: _fetch_drive_pdf(fid)) if fid else (lambda: open_object(pdf_url)),
+    }
+    # Si falla otra lectura, el PDF ya abierto se cierra (no queda el spool/descarga colgando)
+    fetched = prefetch(tasks, label="prefetch_process_pdf",
+                       discard=lambda name, value: value.close() if name == "pdf" else None)
+    revisions = fetched["revisions"]
+    pdf: PdfSource = fetched["pdf"]
+    try:
+        # Prompts: con la revisión conocida, un hit de caché no cuesta peticiones
+        prompts = prefetch({
+            "system": lambda: get_cached_document_content(
+                system_instructions_doc_id, revision=revisions[system_instructions_doc_id]
+            ),
+            "base": lambda: get_cached_document_content(
+                base_prompt_doc_id, revision=revisions[base_prompt_doc_id]
+            ),
+        }, label="prefetch_prompts")
+        system_text = prompts["system"]
+        base_prompt = prompts["base"]
+
+        # Cómo viaja el PDF al modelo: texto plano, PDF (entero o por chunks) o mixto
+        overhead = build_prompt(system_text, base_prompt, "", additional_params)
+        chunks, input_tokens = _plan_pdf_source(pdf, overhead=overhead)
+    finally:
+        pdf.close()
+
+    prefix_key = prefix_key_for(revisions, system_instructions_doc_id, base_prompt_doc_id)
+    result = _generate(
+        chunks,
+        system_text=system_text,
+        base_prompt=base_prompt,
+        params=additional_params,
+        prefix_key=prefix_key,
+        input_tokens=input_tokens,
+        use_cache=use_cache,
+        stream=settings.vertex_stream_output,
+    )
 
-    # Llamada al modelo
-    if len(gs_uris) == 1:
-        ai_output = generate_text_with_files(prompt_text, gs_uris)
+    # Streaming: el Doc de salida se va llenando mientras el modelo genera
+    if settings.vertex_stream_output:
+        write_stream_to_document(output_doc_id, result)
     else:
-        ai_output = generate_text_from_files_map_reduce(system_text, base_prompt, gs_uris, additional_params)
+        write_to_document(output_doc_id, result or "")
 
-    # Escribir resultado
-    write_to_document(output_doc_id, ai_output or "")
     output_link = f"https://docs.google.com/document/d/{output_doc_id}/edit"
     logger.info("✅ Proceso PDF completado.")
     return {
@@ -0,0 +1,155 @@
+# src/services/pdf_split.py
+from __future__ import annotations
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from io import BytesIO
+from itertools import islice
+from typing import BinaryIO, Deque, Iterator, List, Optional, Tuple
+
+from PyPDF2 import PdfReader, PdfWriter
+
+from src.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+PageRange = Tuple[int, int]  # [start, end) 0-based
+
+
+def page_ranges(start: int, end: int, pages_per_chunk: int) -> List[PageRange]:
+    """Parte las páginas [start, end) en tramos de `pages_per_chunk` (fin exclusivo)."""
+    return [(a, min(a + pages_per_chunk, end)) for a in range(start, end, pages_per_chunk)]
+
+
+def iter_pdf_ranges(reader: PdfReader, ranges: List[PageRange]) -> Iterator[bytes]:
+    """
+    Genera los bytes de un PDF por cada tramo de páginas a partir del reader
+    ya parseado, en el hilo actual. Perezoso: solo un chunk vive en memoria.
+    """
+    for start, end in ranges:
+        w = PdfWriter()
+        for i in range(start, end):
+            w.add_page(reader.pages[i])
+        out = BytesIO()
+        w.write(out)
+        yield out.getvalue()
+
+
+# ---------- pool de procesos ----------
+
+def _write_range(source_path: str, start: int, end: int, out_dir: str) -> str:
+    """
+    (Proceso hijo) Copia las páginas [start, end) a un PDF nuevo en `out_dir`
+    y devuelve su ruta: los bytes vuelven por archivo, no por pickle.
+    """
+    reader = PdfReader(source_path)
+    w = PdfWriter()
+    for i in range(start, end):
+        w.add_page(reader.pages[i])
+    fd, path = tempfile.mkstemp(dir=out_dir, suffix=".pdf")
+    with os.fdopen(fd, "wb") as fh:
+        w.write(fh)
+    return path
+
+
+@lru_cache(maxsize=1)
+def get_split_pool() -> ProcessPoolExecutor:
+    """Pool de procesos único para el trabajo CPU de PyPDF2 (spawn: seguro con hilos)."""
+    workers = max(1, settings.pdf_split_processes)
+    logger.info(f"⚙️ Pool de split de PDF con {workers} proceso(s).")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+_pool_lock = threading.Lock()
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """Olvida un pool roto (p. ej. un worker muerto por OOM) para que el siguiente split cree otro."""
+    with _pool_lock:
+        if get_split_pool.cache_info().currsize and get_split_pool() is pool:
+            get_split_pool.cache_clear()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _file_path(source: BinaryIO) -> Optional[str]:
+    """Ruta del archivo detrás de `source`, si la tiene (p. ej. la descarga ya volcada a disco)."""
+    name = getattr(source, "name", None)
+    return name if isinstance(name, str) and os.path.isfile(name) else None
+
+
+def iter_pdf_ranges_pooled(reader: PdfReader, source: BinaryIO, ranges: List[PageRange]) -> Iterator[bytes]:
+    """
+    Como `iter_pdf_ranges`, pero cada tramo se genera en el pool de procesos
+    (sin retener el GIL del servidor). Los procesos leen el archivo de `source`
+    si ya está en disco; si no, se copia una vez a `pdf_spool_dir`. Como mucho
+    `pdf_split_processes` tramos en vuelo: cada chunk se entrega (y se borra)
+    en orden en cuanto termina, antes de encargar el siguiente. Si el pool se
+    rompe, se recrea para el siguiente split y este sigue en el hilo actual.
+    """
+    source_path = _file_path(source)
+    work_dir = tempfile.mkdtemp(prefix="pdf-split-",
+                                dir=settings.pdf_spool_dir or (os.path.dirname(source_path) if source_path else None))
+    try:
+        if source_path:
+            source.flush()
+        else:
+            source_path = os.path.join(work_dir, "source.pdf")
+            source.seek(0)
+            with open(source_path, "wb") as fh:
+                shutil.copyfileobj(source, fh, length=1024 * 1024)
+
+        t0 = time.perf_counter()
+        pool = get_split_pool()
+        in_flight: Deque[Future] = deque()
+        pending = iter(ranges)
+        max_in_flight = max(1, settings.pdf_split_processes)
+        done = 0
+        where = "el pool de procesos"
+        try:
+            while True:
+                for a, b in islice(pending, max_in_flight - len(in_flight)):
+                    in_flight.append(pool.submit(_write_range, source_path, a, b, work_dir))
+                if not in_flight:
+                    break
+                path = in_flight.popleft().result()
+                with open(path, "rb") as fh:
+                    data = fh.read()
+                os.remove(path)
+                done += 1
+                yield data
+        except BrokenProcessPool as e:
+            logger.warning(f"⚠️ Pool de split roto ({e}); se recrea y se sigue en el hilo actual "
+                           f"({len(ranges) - done} chunk(s)).")
+            _discard_pool(pool)
+            where = "el hilo actual (pool roto)"
+            yield from iter_pdf_ranges(reader, ranges[done:])
+        finally:
+            for fut in in_flight:
+                fut.cancel()
+        logger.info(f"✂️ Split de {len(ranges)} chunk(s) en {where} en {time.perf_counter() - t0:.2f}s.")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def split_pdf_ranges(reader: PdfReader, source: BinaryIO, ranges: List[PageRange]) -> Iterator[bytes]:
+    """
+    Bytes de cada tramo, en orden. Con `pdf_split_processes > 0`, al menos
+    `pdf_split_min_pages` páginas a copiar y el PDF en disco (archivo propio o
+    `pdf_spool_dir`) usa el pool de procesos; si no, el hilo actual. Para PDFs
+    pequeños no compensa el arranque de procesos, y copiar a /tmp un PDF en
+    GCS lo duplicaría en memoria (en Cloud Run /tmp es RAM).
+    """
+    pages = sum(b - a for a, b in ranges)
+    on_disk = _file_path(source) is not None or bool(settings.pdf_spool_dir)
+    if settings.pdf_split_processes > 0 and pages >= settings.pdf_split_min_pages and on_disk:
+        return iter_pdf_ranges_pooled(reader, source, ranges)
+    return iter_pdf_ranges(reader, ranges)
@@ -0,0 +1,283 @@
+# src/services/pdf_staging.py
+from __future__ import annotations
+
+import json
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, List, Optional, Tuple
+from uuid import uuid4
+
+from PyPDF2 import PdfReader
+
+from src.clients.drive_client import download_file_to
+from src.clients.gcs_client import (
+    GCSObjectFile, get_storage_client, open_object, touch_blobs, upload_bytes, upload_file, upload_many,
+)
+from src.services.pdf_split import page_ranges, split_pdf_ranges
+from src.settings import settings
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Objetos de staging con ruta aleatoria (versiones anteriores); también se limpian
+_LEGACY_PREFIX = "uploads/"
+_MANIFEST = "manifest.json"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _staging_root(digest: str) -> str:
+    return f"{settings.pdf_staging_prefix.rstrip('/')}/{digest}"
+
+
+def _chunk_dir(digest: str, pages_per_chunk: int) -> str:
+    """Ruta de los chunks: depende del contenido Y del parámetro de chunking."""
+    return f"{_staging_root(digest)}/p{pages_per_chunk}"
+
+
+# ---------- manifiesto ----------
+
+def _read_manifest(bucket_name: str, chunk_dir: str) -> Optional[List[str]]:
+    """
+    URIs de los chunks si un staging anterior quedó completo: el manifiesto se
+    escribe al final y además se comprueba que sigan todos los chunks (el
+    lifecycle del bucket puede haber borrado alguno). Al reutilizarlos se
+    renueva su `customTime` (chunks y manifiesto).
+    """
+    from google.api_core.exceptions import NotFound
+
+    client = get_storage_client()
+    try:
+        manifest = json.loads(client.bucket(bucket_name).blob(f"{chunk_dir}/{_MANIFEST}").download_as_bytes())
+    except NotFound:
+        return None
+    present = {b.name: b for b in client.list_blobs(bucket_name, prefix=f"{chunk_dir}/")}
+    paths = manifest.get("chunks") or []
+    if not paths or any(p not in present for p in paths):
+        logger.warning(f"⚠️ Manifiesto incompleto en gs://{bucket_name}/{chunk_dir}; se vuelve a subir.")
+        return None
+    touch_blobs(present[p] for p in [*paths, f"{chunk_dir}/{_MANIFEST}"] if p in present)
+    return [f"gs://{bucket_name}/{p}" for p in paths]
+
+
+def _write_manifest(bucket_name: str, chunk_dir: str, digest: str, pages: int,
+                    pages_per_chunk: int, uris: List[str]) -> None:
+    manifest = {
+        "sha256": digest,
+        "pages": pages,
+        "pages_per_chunk": pages_per_chunk,
+        "chunks": [u[len(f"gs://{bucket_name}/"):] for u in uris],
+        "created": datetime.now(timezone.utc).isoformat(),
+    }
+    upload_bytes(bucket_name, json.dumps(manifest).encode("utf-8"), path=f"{chunk_dir}/{_MANIFEST}",
+                 content_type="application/json", custom_time=_now())
+
+
+# ---------- staging ----------
+
+def _upload_once(bucket_name: str, path: str, source: BinaryIO, size: int) -> str:
+    blob = get_storage_client().bucket(bucket_name).get_blob(path)
+    if blob is not None:
+        logger.info(f"♻️ PDF ya en staging: gs://{bucket_name}/{path} (sin subir).")
+        touch_blobs([blob])
+        return f"gs://{bucket_name}/{path}"
+    return upload_file(bucket_name, source, path=path, size=size, custom_time=_now())
+
+
+def stage_pdf(reader: PdfReader, source: BinaryIO, digest: str, size: int, pages_per_chunk: int) -> List[str]:
+    """
+    Sube el PDF (entero o por chunks) al bucket de staging y devuelve las
+    gs:// URIs. Las rutas salen del sha256 del contenido (`digest`) y del
+    chunking, así que un PDF ya visto no se vuelve a subir ni a partir.
+    El PDF entero se sube en streaming desde `source`; solo se recorren las
+    páginas del reader cuando hay que partirlo.
+    """
+    bucket_name = settings.pdf_staging_bucket
+    if not bucket_name:
+        raise RuntimeError("Falta PDF_STAGING_BUCKET en configuración.")
+    n = len(reader.pages)
+    if n <= pages_per_chunk:
+        return [_upload_once(bucket_name, f"{_staging_root(digest)}/source.pdf", source, size)]
+
+    chunk_dir = _chunk_dir(digest, pages_per_chunk)
+    cached = _read_manifest(bucket_name, chunk_dir)
+    if cached:
+        logger.info(f"♻️ {len(cached)} chunk(s) ya en staging (sha256={digest[:12]}…, "
+                    f"{pages_per_chunk} pág/chunk): sin split ni subida.")
+        return cached
+
+    # El split (generador, en el pool de procesos si el PDF es grande) se solapa con las subidas
+    uris = upload_many(
+        bucket_name,
+        split_pdf_ranges(reader, source, page_ranges(0, n, pages_per_chunk)),
+        path_for=lambda i: f"{chunk_dir}/{i:04d}.pdf",
+        custom_time=_now(),
+    )
+    _write_manifest(bucket_name, chunk_dir, digest, n, pages_per_chunk, uris)
+    return uris
+
+
+def stage_pdf_ranges(reader: PdfReader, source: BinaryIO, digest: str,
+                     ranges: List[Tuple[int, int]]) -> List[str]:
+    """
+    Sube a staging un PDF por tramo de páginas (p. ej. solo las escaneadas)
+    en `staging/<sha256>/pages/<desde>-<hasta>.pdf` y devuelve sus URIs en el
+    mismo orden. Los tramos que ya están en el bucket no se vuelven a generar.
+    """
+    bucket_name = settings.pdf_staging_bucket
+    if not bucket_name:
+        raise RuntimeError("Falta PDF_STAGING_BUCKET en configuración.")
+    pages_dir = f"{_staging_root(digest)}/pages"
+    paths = [f"{pages_dir}/{a + 1}-{b}.pdf" for a, b in ranges]
+    present = {b.name: b for b in get_storage_client().list_blobs(bucket_name, prefix=f"{pages_dir}/")}
+    missing = [i for i, p in enumerate(paths) if p not in present]
+    if len(missing) < len(paths):
+        logger.info(f"♻️ {len(paths) - len(missing)}/{len(paths)} tramo(s) ya en staging (sha256={digest[:12]}…).")
+        touch_blobs(present[p] for p in paths if p in present)
+    if missing:
+        upload_many(
+            bucket_name,
+            split_pdf_ranges(reader, source, [ranges[i] for i in missing]),
+            path_for=lambda k: paths[missing[k]],
+            custom_time=_now(),
+        )
+    return [f"gs://{bucket_name}/{p}" for p in paths]
+
+
+def stage_drive_pdf(file_id: str) -> GCSObjectFile:
+    """
+    Lleva un PDF de Drive a `staging/<sha256>/source.pdf` sin pasar por el
+    disco local (en Cloud Run, /tmp es memoria): los trozos de la descarga van
+    directos a un upload resumable en `staging/_incoming/`, y con el sha256 ya
+    calculado se copia (en el servidor) a su ruta por contenido. Devuelve el
+    objeto abierto para lectura por rangos.
+    """
+    bucket_name = settings.pdf_staging_bucket
+    if not bucket_name:
+        raise RuntimeError("Falta PDF_STAGING_BUCKET en configuración.")
+    bucket = get_storage_client().bucket(bucket_name)
+    incoming = bucket.blob(f"{settings.pdf_staging_prefix.rstrip('/')}/_incoming/{uuid4()}.pdf",
+                           chunk_size=settings.gcs_upload_chunk_size)
+    incoming.custom_time = _now()  # si el job muere aquí, el lifecycle lo limpia
+    t0 = time.perf_counter()
+    try:
+        with incoming.open("wb", content_type="application/pdf") as fh:
+            digest, size = download_file_to(file_id, fh)
+        path = f"{_staging_root(digest)}/source.pdf"
+        existing = bucket.get_blob(path)
+        if existing is not None:
+            touch_blobs([existing])
+        else:
+            dest = bucket.blob(path)
+            dest.content_type = "application/pdf"
+            dest.custom_time = _now()
+            token, _, _ = dest.rewrite(incoming)
+            while token is not None:
+                token, _, _ = dest.rewrite(incoming, token=token)
+    finally:
+        try:
+            incoming.delete()
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo borrar gs://{bucket_name}/{incoming.name}: {e}")
+    logger.info(f"⬇️ Drive {file_id} → gs://{bucket_name}/{path}: {size / 1e6:.1f} MB en "
+                f"{time.perf_counter() - t0:.2f}s (sin disco local).")
+    return open_object(f"gs://{bucket_name}/{path}", sha256=digest)
+
+
+# ---------- limpieza ----------
+# El staging caduca por último uso (`customTime`, renovado en cada reutilización),
+# no por antigüedad: un PDF que se vuelve a auditar no pierde sus chunks a mitad
+# de job. Lo legado (rutas aleatorias, nunca reutilizado) sigue caducando por edad.
+
+def _staging_rules(days: int) -> List[dict]:
+    return [
+        {"action": {"type": "Delete"},
+         "condition": {"daysSinceCustomTime": days, "matchesPrefix": [settings.pdf_staging_prefix]}},
+        {"action": {"type": "Delete"},
+         "condition": {"age": days, "matchesPrefix": [_LEGACY_PREFIX]}},
+    ]
+
+
+def _is_staging_rule(rule: dict) -> bool:
+    prefixes = (rule.get("condition") or {}).get("matchesPrefix") or []
+    return rule.get("action", {}).get("type") == "Delete" and bool(
+        {settings.pdf_staging_prefix, _LEGACY_PREFIX} & set(prefixes))
+
+
+def ensure_staging_lifecycle(max_age_days: Optional[int] = None) -> bool:
+    """
+    Deja en el bucket de staging las reglas de lifecycle: borrar el staging sin
+    usar en `pdf_staging_ttl_days` días (`daysSinceCustomTime`) y lo legado con
+    esa antigüedad. Sustituye reglas de staging previas (p. ej. por `age`).
+    True si cambió algo.
+    """
+    days = max_age_days or settings.pdf_staging_ttl_days
+    bucket = get_storage_client().get_bucket(settings.pdf_staging_bucket)
+    current = [dict(rule) for rule in bucket.lifecycle_rules]
+    others = [rule for rule in current if not _is_staging_rule(rule)]
+    wanted = _staging_rules(days)
+    if [rule for rule in current if _is_staging_rule(rule)] == wanted:
+        return False
+    bucket.lifecycle_rules = others + wanted
+    bucket.patch()
+    logger.info(f"🧹 Lifecycle de gs://{bucket.name}: borrar {settings.pdf_staging_prefix} sin usar en {days} días "
+                f"y {_LEGACY_PREFIX} con más de {days} días.")
+    return True
+
+
+def _response_cache_rule(days: int) -> dict:
+    return {"action": {"type": "Delete"},
+            "condition": {"age": days, "matchesPrefix": [settings.response_cache_prefix]}}
+
+
+def ensure_response_cache_lifecycle() -> bool:
+    """
+    Regla de lifecycle para el backend `gcs` de la caché de respuestas: borrar
+    lo de `response_cache_prefix` pasado su TTL (en días, redondeado hacia
+    arriba). Sin ella el prefijo crece sin límite. True si cambió algo.
+    """
+    days = max(1, math.ceil(settings.response_cache_ttl_s / 86400))
+    bucket_name = settings.response_cache_bucket or settings.pdf_staging_bucket
+    bucket = get_storage_client().get_bucket(bucket_name)
+    current = [dict(rule) for rule in bucket.lifecycle_rules]
+    mine = [rule for rule in current if rule.get("action", {}).get("type") == "Delete"
+            and (rule.get("condition") or {}).get("matchesPrefix") == [settings.response_cache_prefix]]
+    wanted = _response_cache_rule(days)
+    if mine == [wanted]:
+        return False
+    bucket.lifecycle_rules = [rule for rule in current if rule not in mine] + [wanted]
+    bucket.patch()
+    logger.info(f"🧹 Lifecycle de gs://{bucket.name}: borrar {settings.response_cache_prefix} con más de {days} días.")
+    return True
+
+
+def cleanup_staging(max_age_days: Optional[int] = None) -> int:
+    """
+    Borra ya el staging sin usar en `pdf_staging_ttl_days` días (`customTime`,
+    o la creación si no lo tiene) y lo legado con esa antigüedad (para
+    buckets sin lifecycle). Devuelve cuántos borró.
+    """
+    days = max_age_days or settings.pdf_staging_ttl_days
+    cutoff = _now() - timedelta(days=days)
+    client = get_storage_client()
+    deleted = 0
+    for prefix in (settings.pdf_staging_prefix, _LEGACY_PREFIX):
+        for blob in client.list_blobs(settings.pdf_staging_bucket, prefix=prefix):
+            last_used = (blob.custom_time if prefix != _LEGACY_PREFIX else None) or blob.time_created
+            if last_used and last_used < cutoff:
+                blob.delete()
+                deleted += 1
+    logger.info(f"🧹 Staging: {deleted} objeto(s) sin usar en {days} días borrados.")
+    return deleted
+
+
+if __name__ == "__main__":
+    # python -m src.services.pdf_staging  → aplica el lifecycle y limpia lo caducado
+    assert settings.pdf_staging_bucket, "Falta PDF_STAGING_BUCKET"
+    ensure_staging_lifecycle()
+    cleanup_staging()
+    if (settings.response_cache_backend or "").lower() == "gcs":
+        ensure_response_cache_lifecycle()
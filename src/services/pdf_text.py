@@ -0,0 +1,240 @@
+# src/services/pdf_text.py
+from __future__ import annotations
+
+import json
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import BinaryIO, List, Optional, Tuple
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import DictionaryObject, IndirectObject, NameObject
+
+from src.settings import settings
+from src.utils.logger import get_logger
+from src.utils.metrics import register_metrics
+from src.utils.ttl_cache import TTLCache
+
+logger = get_logger(__name__)
+
+TEXT = "text"   # página con capa de texto utilizable → se envía como texto plano
+SCAN = "scan"   # página solo imagen (escaneada) → se envía como PDF
+
+_LAYER_FILE = "text_layer.json"
+
+# Extracción por ventanas de páginas: al cerrar cada una se sueltan los objetos resueltos
+_WINDOW_PAGES = 16
+# Cabecera de un objeto: lo justo para leer su diccionario sin tocar el stream
+_PEEK_BYTES = 4096
+_SUBTYPE = re.compile(rb"/Subtype\s*/(\w+)")
+
+
+@dataclass
+class PageText:
+    text: str
+    has_xobject: bool   # imágenes en la página (directas o dentro de Form XObjects)
+
+
+@dataclass
+class TextLayer:
+    """
+    Capa de texto extraída de un PDF (por contenido: sha256). Guarda los datos
+    crudos por página; la clasificación se calcula con los umbrales actuales.
+    """
+    sha256: str
+    pages: List[PageText]
+
+    def kind(self, i: int) -> str:
+        """
+        TEXT solo si el texto extraído basta para representar la página:
+        - con imágenes (escaneos, sellos, firmas, gráficos), solo si el texto
+          domina (`pdf_text_dominant_chars_per_page`); si no, se perderían.
+        - sin imágenes, desde `pdf_text_min_chars_per_page`; por debajo puede
+          ser texto en curvas o imágenes inline que no se extraen.
+        """
+        page = self.pages[i]
+        chars = len(page.text.strip())
+        if page.has_xobject:
+            return TEXT if chars >= settings.pdf_text_dominant_chars_per_page else SCAN
+        return TEXT if chars >= settings.pdf_text_min_chars_per_page else SCAN
+
+    def kinds(self) -> List[str]:
+        return [self.kind(i) for i in range(len(self.pages))]
+
+    @property
+    def scanned_pages(self) -> int:
+        return sum(1 for k in self.kinds() if k == SCAN)
+
+    def runs(self) -> List[Tuple[str, int, int]]:
+        """Tramos consecutivos del mismo tipo: [(kind, start, end)] con `end` exclusivo."""
+        runs: List[Tuple[str, int, int]] = []
+        for i, k in enumerate(self.kinds()):
+            if runs and runs[-1][0] == k:
+                runs[-1] = (k, runs[-1][1], i + 1)
+            else:
+                runs.append((k, i, i + 1))
+        return runs
+
+    def text_of(self, start: int, end: int) -> str:
+        """Texto de las páginas [start, end) con marcas de página (1-based) para poder citarlas."""
+        return "\n\n".join(f"[Página {i + 1}]\n{self.pages[i].text.strip()}" for i in range(start, end))
+
+    def chars(self) -> int:
+        return sum(len(p.text) for p in self.pages)
+
+
+_layer_cache: TTLCache[TextLayer] = TTLCache(
+    max_entries=settings.pdf_text_cache_max_entries,
+    ttl_s=settings.pdf_staging_ttl_days * 86400,
+    max_bytes=settings.pdf_text_cache_max_chars,
+    sizeof=lambda layer: layer.chars(),
+)
+register_metrics("pdf_text_layer_cache", _layer_cache.stats)
+
+
+def _peek_subtype(reader: PdfReader, ref) -> Optional[str]:
+    """
+    `/Subtype` de un XObject leyendo solo la cabecera del objeto (sin cargar
+    su stream). None si no se puede saber así: el llamador lo resuelve entero.
+    """
+    if not isinstance(ref, IndirectObject):
+        return None
+    offset = reader.xref.get(ref.generation, {}).get(ref.idnum)
+    if offset is None:  # dentro de un object stream: no es un stream, resolverlo es barato
+        return None
+    reader.stream.seek(offset)
+    head = reader.stream.read(_PEEK_BYTES)
+    if not re.match(rb"\s*%d\s+%d\s+obj" % (ref.idnum, ref.generation), head):
+        return None
+    m = _SUBTYPE.search(head.split(b"stream", 1)[0])
+    return m.group(1).decode("latin-1") if m else None
+
+
+def _stub_image(reader: PdfReader, ref: IndirectObject) -> None:
+    """
+    Deja en la caché del reader un diccionario sin datos para la imagen:
+    `extract_text` solo mira su `/Subtype` y así no lee el stream (un
+    escaneo entero acabaría en `resolved_objects`).
+    """
+    reader.resolved_objects[(ref.generation, ref.idnum)] = DictionaryObject({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+    })
+
+
+def _has_images(reader: PdfReader, resources, depth: int = 0) -> bool:
+    """Imágenes en los XObjects de `resources`, entrando en los Form XObjects (logos, sellos…)."""
+    xobjects = resources.get_object().get("/XObject") if resources else None
+    if not xobjects:
+        return False
+    found = False
+    for ref in xobjects.get_object().values():
+        subtype = _peek_subtype(reader, ref)
+        if subtype == "Image":
+            _stub_image(reader, ref)
+            found = True
+            continue
+        xobj = ref.get_object()
+        subtype = xobj.get("/Subtype")
+        if subtype == "/Image":
+            found = True
+        elif subtype == "/Form" and depth < 4 and _has_images(reader, xobj.get("/Resources"), depth + 1):
+            found = True
+    return found
+
+
+def _has_xobject(reader: PdfReader, page) -> bool:
+    try:
+        return _has_images(reader, page.get("/Resources"))
+    except Exception:
+        return True  # ante la duda, que vaya como PDF
+
+
+def _extract(file: BinaryIO) -> List[PageText]:
+    """
+    Texto por página con un reader propio que se descarta al terminar: el
+    del job no se queda con lo resuelto aquí. Por ventanas de páginas, vaciando
+    `resolved_objects` al cerrar cada una, y sin leer los streams de imagen:
+    la memoria no crece con el tamaño del PDF ni un PDF en GCS se lee entero.
+    """
+    reader = PdfReader(file)
+    pages: List[PageText] = []
+    for i, page in enumerate(reader.pages):
+        has_xobject = _has_xobject(reader, page)  # antes de extraer: deja las imágenes como stubs
+        try:
+            text = page.extract_text() or ""
+        except Exception as e:
+            logger.debug(f"extract_text falló en una página: {e}")
+            text = ""
+        pages.append(PageText(text=text, has_xobject=has_xobject))
+        if (i + 1) % _WINDOW_PAGES == 0:
+            reader.resolved_objects.clear()
+    return pages
+
+
+# ---------- persistencia junto al staging (compartida entre instancias) ----------
+
+def _layer_path(sha256: str) -> str:
+    return f"{settings.pdf_staging_prefix.rstrip('/')}/{sha256}/{_LAYER_FILE}"
+
+
+def _load_from_gcs(sha256: str) -> Optional[TextLayer]:
+    if not settings.pdf_staging_bucket:
+        return None
+    from google.api_core.exceptions import NotFound
+    from src.clients.gcs_client import get_storage_client, touch_blobs
+
+    blob = get_storage_client().bucket(settings.pdf_staging_bucket).get_blob(_layer_path(sha256))
+    if blob is None:
+        return None
+    try:
+        raw = json.loads(blob.download_as_bytes())
+    except NotFound:
+        return None
+    touch_blobs([blob])  # caduca por último uso, como el resto del staging
+    return TextLayer(sha256, [PageText(p["text"], p["xobject"]) for p in raw["pages"]])
+
+
+def _save_to_gcs(layer: TextLayer) -> None:
+    if not settings.pdf_staging_bucket:
+        return
+    from src.clients.gcs_client import upload_bytes
+
+    payload = {"sha256": layer.sha256, "pages": [{"text": p.text, "xobject": p.has_xobject} for p in layer.pages]}
+    try:
+        upload_bytes(settings.pdf_staging_bucket, json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                     path=_layer_path(layer.sha256), content_type="application/json",
+                     custom_time=datetime.now(timezone.utc))
+    except Exception as e:  # la caché es un atajo: nunca rompe el job
+        logger.warning(f"⚠️ No se pudo guardar la capa de texto en GCS: {e}")
+
+
+def get_text_layer(file: BinaryIO, sha256: str) -> TextLayer:
+    """
+    Capa de texto del PDF en `file`, cacheada por hash de contenido (memoria →
+    GCS → extracción con PyPDF2). Registra en el log la clasificación por página.
+    """
+    t0 = time.perf_counter()
+    source = "memoria"
+    layer = _layer_cache.get(sha256)
+    if layer is None:
+        try:
+            layer = _load_from_gcs(sha256)
+            source = "gcs"
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo leer la capa de texto de GCS: {e}")
+            layer = None
+        if layer is None:
+            layer = TextLayer(sha256, _extract(file))
+            source = "extracción"
+            _save_to_gcs(layer)
+        _layer_cache.put(sha256, layer)
+
+    n = len(layer.pages)
+    scanned = layer.scanned_pages
+    logger.info(
+        f"📝 Capa de texto (sha256={sha256[:12]}…, {source}): {n - scanned} pág. con texto, "
+        f"{scanned} escaneada(s), {len(layer.runs())} tramo(s) en {time.perf_counter() - t0:.2f}s."
+    )
+    return layer
@@ -2,14 +2,34 @@
 from __future__ import annotations
 from typing import Dict, Any
 
-from src.clients.gdocs_client import get_document_content
-from src.clients.vertex_client import generate_text
+from src.clients.gdocs_client import get_cached_document_content, get_document_revisions, load_document
+from src.clients.vertex_client import MapChunk, generate_text, generate_text_map_reduce, select_model
 from src.clients.writer_api_client import send_to_writer_service
 from src.utils.logger import get_logger
-from src.clients.drive_client import assert_sa_has_access
+from src.clients.drive_client import FileAccessError
+from src.services.chunk_planner import plan_text, split_text
+from src.services.prefetch import prefetch
 
 logger = get_logger(__name__)
 
+def split_cache_flag(additional_params: Dict[str, Any]) -> tuple[Dict[str, Any], bool]:
+    """
+    Separa el flag `bypass_cache` de `additional_params` (no debe llegar al prompt).
+    Devuelve (params sin el flag, use_cache).
+    """
+    params = dict(additional_params or {})
+    raw = params.pop("bypass_cache", False)
+    # JSON puede traerlo como bool o como string ("false" no debe contar como bypass)
+    bypass = raw if isinstance(raw, bool) else str(raw).strip().lower() in ("true", "1", "yes")
+    return params, not bypass
+
+def prefix_key_for(revisions: Dict[str, str], system_doc_id: str, base_doc_id: str) -> str | None:
+    """Clave del prefijo system+base por revisión de los Docs (None si falta alguna)."""
+    sys_rev, base_rev = revisions.get(system_doc_id), revisions.get(base_doc_id)
+    if not (sys_rev and base_rev):
+        return None
+    return f"{system_doc_id}@{sys_rev}|{base_doc_id}@{base_rev}"
+
 def build_prompt(system_text: str, base_prompt: str, input_text: str, params: Dict[str, Any]) -> str:
     prompt = []
     if system_text.strip(): prompt.append(f"[SYSTEM]\n{system_text.strip()}\n")
@@ -30,19 +50,45 @@ def process_documents(
     # Envolvemos todo en un try-except general para el log de fondo
     try:
         logger.info("🚀 [Fondo] Iniciando proceso de IA...")
+        params, use_cache = split_cache_flag(additional_params)
         
-        # 1. Validar accesos
-        for fid in (system_instructions_doc_id, base_prompt_doc_id, input_doc_id, output_doc_id):
-            assert_sa_has_access(fid)
-
-        # 2. Leer contenidos
-        system_text = get_document_content(system_instructions_doc_id)
-        base_prompt = get_document_content(base_prompt_doc_id)
-        input_text = get_document_content(input_doc_id)
-
-        # 3. Prompt y Vertex
-        full_prompt = build_prompt(system_text, base_prompt, input_text, additional_params)
-        ai_output = generate_text(full_prompt) or ""
+        # 1. Validar accesos (system/base/output en un solo batch con máscara
+        #    mínima) mientras se lee el Doc de entrada (una sola petición)
+        fetched = prefetch({
+            "revisions": lambda: get_document_revisions(
+                (system_instructions_doc_id, base_prompt_doc_id, output_doc_id)
+            ),
+            "input": lambda: load_document(input_doc_id).text,
+        }, label="prefetch_process")
+        revisions = fetched["revisions"]
+        input_text = fetched["input"]
+
+        # 2. Prompts: con la revisión conocida, un hit de caché no cuesta peticiones
+        prompts = prefetch({
+            "system": lambda: get_cached_document_content(
+                system_instructions_doc_id, revision=revisions[system_instructions_doc_id]
+            ),
+            "base": lambda: get_cached_document_content(
+                base_prompt_doc_id, revision=revisions[base_prompt_doc_id]
+            ),
+        }, label="prefetch_prompts")
+        system_text = prompts["system"]
+        base_prompt = prompts["base"]
+
+        # 3. Plan por presupuesto de tokens → prompt único o Map-Reduce sobre el texto
+        plan = plan_text(input_text, overhead=build_prompt(system_text, base_prompt, "", params))
+        plan.log("process")
+        if plan.map_reduce:
+            chunks = [MapChunk(text=t) for t in split_text(input_text, plan.chars_per_chunk or len(input_text))]
+            ai_output = generate_text_map_reduce(
+                system_text, base_prompt, chunks, params,
+                prefix_key=prefix_key_for(revisions, system_instructions_doc_id, base_prompt_doc_id),
+                use_cache=use_cache,
+            ) or ""
+        else:
+            full_prompt = build_prompt(system_text, base_prompt, input_text, params)
+            model_id = select_model("single", input_tokens=plan.total_tokens)
+            ai_output = generate_text(full_prompt, model_id=model_id, use_cache=use_cache) or ""
         
         if not ai_output:
             logger.error("❌ La IA no devolvió contenido.")
@@ -56,5 +102,8 @@ def process_documents(
         else:
             logger.warning(f"⚠️ El Writer Service falló para el doc: {output_doc_id}")
 
+    except FileAccessError as e:
+        logger.error(f"🔒 Sin acceso a un documento del job: {e.to_dict()}")
+        return {"status": "error", "error": e.to_dict()}
     except Exception as e:
         logger.error(f"❌ Error crítico en la tarea de fondo: {str(e)}", exc_info=True)    
\ No newline at end of file
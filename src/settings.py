@@ -29,6 +29,30 @@ class Settings(BaseSettings):
 
     # --- Vertex AI ---
     vertex_model_id: str = "gemini-2.5-flash"
+    # Ruteo por etapa (None → vertex_model_id)
+    vertex_map_model_id: Optional[str] = None      # MAP: modelo rápido/barato
+    vertex_reduce_model_id: Optional[str] = None   # REDUCE: modelo más capaz
+    vertex_small_model_id: Optional[str] = None    # single-shot con entrada pequeña
+    vertex_small_input_max_tokens: int = 20_000    # umbral para usar vertex_small_model_id
+    vertex_map_concurrency: int = 4      # chunks del MAP en paralelo
+    vertex_map_max_retries: int = 2      # reintentos por chunk fallido
+    vertex_reduce_fan_in: int = 8        # parciales por REDUCE (reduce jerárquico)
+    vertex_rpm: int = 60                 # techo de peticiones/min (limitador compartido)
+    vertex_tpm: int = 2_000_000          # techo de tokens/min
+    vertex_max_retries: int = 5          # reintentos en 429/5xx (backoff con jitter)
+    vertex_retry_base_s: float = 2.0
+    vertex_context_cache_enabled: bool = True   # CachedContent para el prefijo system+base
+    vertex_context_cache_ttl_s: int = 3600
+    vertex_stream_output: bool = False   # /process-pdf: escribe en el Doc mientras genera
+
+    # --- Caché de respuestas del modelo (opt-in): none | memory | disk | gcs ---
+    response_cache_backend: str = "none"
+    response_cache_ttl_s: int = 24 * 3600
+    response_cache_max_entries: int = 512
+    response_cache_max_bytes: int = 256 * 1024 * 1024
+    response_cache_dir: str = "/tmp/brain-response-cache"
+    response_cache_bucket: Optional[str] = None   # por defecto, pdf_staging_bucket
+    response_cache_prefix: str = "cache/responses/"
 
     # --- Google Workspace / Drive ---
     shared_folder_id: Optional[str] = None
@@ -44,13 +68,62 @@ class Settings(BaseSettings):
     # --- PDFs ---
     pdf_staging_bucket: Optional[str] = None
     pdf_max_pages_per_chunk: int = 60
-    pdf_use_file_api: bool = True
+    pdf_use_file_api: bool = True          # PDFs > pdf_inline_max_bytes por referencia (gs://)
+    pdf_inline_max_bytes: int = 8 * 1024 * 1024   # por debajo: inline (Part.from_data), sin staging
+    pdf_staging_prefix: str = "staging/"   # rutas por sha256 del contenido (dedup entre jobs)
+    pdf_staging_ttl_days: int = 7          # lifecycle / limpieza de objetos de staging
+    # Descarga Drive → GCS en streaming (sin el PDF entero en RAM)
+    pdf_spool_max_memory_bytes: int = 32 * 1024 * 1024   # por encima se vuelca a disco
+    pdf_spool_dir: Optional[str] = None                  # volumen montado; sin él, PDFs grandes van de Drive a GCS
+    drive_download_chunk_size: int = 8 * 1024 * 1024
+    # Split de PDFs (CPU) en un pool de procesos; 0 = en el hilo del job
+    pdf_split_processes: int = 2
+    pdf_split_min_pages: int = 200     # por debajo no compensa arrancar procesos
+    # Atajo por capa de texto: páginas con texto van como texto plano, las escaneadas como PDF
+    pdf_text_fast_path: bool = True
+    pdf_text_min_chars_per_page: int = 200         # sin imágenes: por debajo, la página va como PDF
+    pdf_text_dominant_chars_per_page: int = 1500   # con imágenes: solo como texto si lo domina
+    pdf_text_cache_max_entries: int = 32
+    pdf_text_cache_max_chars: int = 50_000_000
+
+    # --- Planificador de chunks por presupuesto de tokens ---
+    plan_single_shot_max_tokens: int = 150_000   # por encima → Map-Reduce (contexto/latencia)
+    plan_target_chunk_tokens: int = 60_000       # tamaño objetivo de cada chunk del MAP
+    plan_sample_pages: int = 8                   # páginas muestreadas para estimar tokens/página
+    plan_inline_count_max_bytes: int = 15 * 1024 * 1024
 
     # --- Nuevos campos que vienen en tu .env ---
     docs_text_chunk: int = 50_000
     docs_text_chunk_sleep_ms: int = 150
+    docs_write_batch_max_chars: int = 1_000_000   # write_to_document: chars por batchUpdate
+    docs_incremental_write: bool = True           # re-runs: diff por párrafos, solo tramos cambiados
+    docs_incremental_max_change_ratio: float = 0.5   # por encima, reescritura completa
+    docs_markdown_max_ops_per_batch: int = 1000   # write_markdown_to_document (tras compactar)
+    docs_stream_flush_chars: int = 4_000   # escritura incremental: agrupa fragmentos
+    docs_stream_flush_ms: int = 1_500
     app_version: str = "dev"
 
+    # --- Caché de Docs de prompts (system/base), validada por revisionId ---
+    docs_cache_enabled: bool = True
+    docs_cache_ttl_s: int = 6 * 3600
+    docs_cache_max_entries: int = 64
+    docs_cache_max_chars: int = 20_000_000
+
+    # --- Prefetch concurrente de entradas de un job ---
+    prefetch_max_workers: int = 4
+
+    # --- Transporte Google APIs (Drive/Docs/Sheets): pool keep-alive ---
+    google_api_pool_size: int = 20
+    google_api_timeout_s: int = 180
+
+    # --- Subidas de staging a GCS (chunks de PDF en paralelo) ---
+    gcs_upload_concurrency: int = 8
+    gcs_upload_chunk_size: int = 8 * 1024 * 1024   # upload resumable (múltiplo de 256 KiB)
+    gcs_read_chunk_size: int = 8 * 1024 * 1024     # lecturas por rango de PDFs gs://
+
+    # --- Peticiones batch a Google APIs (BatchHttpRequest) ---
+    google_batch_max_size: int = 50
+
     # --- URL del endpoint del servicio que pasa de markdown to google docs
     writer_service_url: str = "https://m2gdw-223080314602.us-central1.run.app/api/v1/write"
 
@@ -13,6 +13,28 @@ class Cursor:
     def advance(self, n: int) -> Tuple[int,int]:
         s = self.i; self.i += n; return s, self.i
 
+# Inline: una sola pasada con un patrón combinado. En cada posición gana la
+# alternativa que empieza antes y, a igualdad, la primera (link > bold > ital > code > strike).
+_INLINE = re.compile(
+    r"(?P<link>\[(?P<link_text>[^\]]+)\]\((?P<link_url>[^)]+)\))"
+    r"|(?P<bold>\*\*(?P<bold_text>[^\*]+)\*\*)"
+    r"|(?P<ital>(?<!\*)\*(?P<ital_text>[^\*]+)\*(?!\*))"
+    r"|(?P<code>`(?P<code_text>[^`]+)`)"
+    r"|(?P<strike>~~(?P<strike_text>[^~]+)~~)"
+)
+_CODE_STYLE = {"weightedFontFamily": {"fontFamily": "Roboto Mono"},
+               "backgroundColor": {"color": {"rgbColor": {"red": 0.95, "green": 0.95, "blue": 0.95}}}}
+_INLINE_STYLES = {"bold": {"bold": True}, "ital": {"italic": True}, "code": _CODE_STYLE,
+                  "strike": {"strikethrough": True}}
+
+# Bloques (por línea)
+_HEADING   = re.compile(r"^(#{1,6})\s+(.*)$")
+_HR        = re.compile(r"^(-{3,}|\*{3,}|_{3,})\s*$")
+_BULLET    = re.compile(r"^\s*([-\*\+])\s+")
+_ORDERED   = re.compile(r"^\s*\d+\.\s+")
+_TABLE_ROW = re.compile(r"^\|.*\|\s*$")
+_TABLE_SEP = re.compile(r"^\|\s*[-:]+\s*\|")
+
 ListPolicy = Literal["auto", "none"]  # "auto" = respeta listas; "none" = no crea viñetas
 
 class MarkdownToDocs:
@@ -100,38 +122,16 @@ class MarkdownToDocs:
         return sp
 
     def _insert_inline_md(self, md: str):
-        i, n = 0, len(md)
-        link_pat   = re.compile(r"\[([^\]]+)\]\(([^)]+)\)")
-        bold_pat   = re.compile(r"\*\*([^\*]+)\*\*")
-        ital_pat   = re.compile(r"(?<!\*)\*([^\*]+)\*(?!\*)")
-        code_pat   = re.compile(r"`([^`]+)`")
-        strike_pat = re.compile(r"~~([^~]+)~~")
-        while i < n:
-            candidates = []
-            for kind, pat in (("link", link_pat), ("bold", bold_pat), ("ital", ital_pat), ("code", code_pat), ("strike", strike_pat)):
-                m = pat.search(md, i)
-                if m: candidates.append((m.start(), kind, m))
-            if not candidates:
-                self._insert_plain_and_style(md[i:], None); break
-            candidates.sort(key=lambda x: x[0])
-            start, kind, m = candidates[0]
-            if start > i: self._insert_plain_and_style(md[i:start], None)
+        i = 0
+        for m in _INLINE.finditer(md):
+            if m.start() > i: self._insert_plain_and_style(md[i:m.start()], None)
+            kind = m.lastgroup  # grupo exterior: link | bold | ital | code | strike
             if kind == "link":
-                txt, url = m.group(1), m.group(2)
-                sp = self._ins(txt); self._tstyle(sp, link={"url": url})
-            elif kind == "bold":
-                self._insert_plain_and_style(m.group(1), {"bold": True})
-            elif kind == "ital":
-                self._insert_plain_and_style(m.group(1), {"italic": True})
-            elif kind == "code":
-                self._insert_plain_and_style(
-                    m.group(1),
-                    {"weightedFontFamily":{"fontFamily":"Roboto Mono"},
-                     "backgroundColor":{"color":{"rgbColor":{"red":0.95,"green":0.95,"blue":0.95}}}}
-                )
-            elif kind == "strike":
-                self._insert_plain_and_style(m.group(1), {"strikethrough": True})
+                sp = self._ins(m.group("link_text")); self._tstyle(sp, link={"url": m.group("link_url")})
+            else:
+                self._insert_plain_and_style(m.group(f"{kind}_text"), _INLINE_STYLES[kind])
             i = m.end()
+        if i < len(md): self._insert_plain_and_style(md[i:], None)
 
     # ---------- render principal ----------
     def render(self, md: str) -> List[dict]:
@@ -142,7 +142,7 @@ class MarkdownToDocs:
             line = lines[i]
 
             # headings
-            m = re.match(r"^(#{1,6})\s+(.*)$", line)
+            m = _HEADING.match(line)
             if m:
                 level = len(m.group(1)); text = m.group(2).strip()
                 sp = self._ins(text + "\n"); self._pstyle(sp, f"HEADING_{level}")
@@ -150,7 +150,7 @@ class MarkdownToDocs:
                 i += 1; continue
 
             # hr
-            if re.match(r"^(-{3,}|\*{3,}|_{3,})\s*$", line):
+            if _HR.match(line):
                 sp = self._hr()
                 if self.list_policy == "none": self._strip_bullets_for(sp)
                 i += 1; continue
@@ -165,16 +165,16 @@ class MarkdownToDocs:
                 i += 1; continue
 
             # listas (si list_policy == "auto")
-            if self.list_policy == "auto" and (re.match(r"^\s*([-\*\+])\s+", line) or re.match(r"^\s*\d+\.\s+", line)):
+            if self.list_policy == "auto" and (_BULLET.match(line) or _ORDERED.match(line)):
                 start_i = i
-                while i < len(lines) and (re.match(r"^\s*([-\*\+])\s+", lines[i]) or re.match(r"^\s*\d+\.\s+", lines[i])):
+                while i < len(lines) and (_BULLET.match(lines[i]) or _ORDERED.match(lines[i])):
                     i += 1
                 block = lines[start_i:i]
                 item_spans=[]
-                ordered = re.match(r"^\s*\d+\.\s+", block[0]) is not None
+                ordered = _ORDERED.match(block[0]) is not None
                 for li in block:
-                    txt = re.sub(r"^\s*([-\*\+])\s+", "", li)
-                    txt = re.sub(r"^\s*\d+\.\s+", "", txt)
+                    txt = _BULLET.sub("", li)
+                    txt = _ORDERED.sub("", txt)
                     start_before = self.idx.i
                     self._insert_inline_md(txt)
                     sp_end = self._ins("\n")
@@ -203,9 +203,9 @@ class MarkdownToDocs:
                 continue
 
             # tabla markdown
-            if re.match(r"^\|.*\|\s*$", line) and i+1 < len(lines) and re.match(r"^\|\s*[-:]+\s*\|", lines[i+1]):
+            if _TABLE_ROW.match(line) and i+1 < len(lines) and _TABLE_SEP.match(lines[i+1]):
                 tbl=[line]; i += 1
-                while i < len(lines) and re.match(r"^\|.*\|\s*$", lines[i]):
+                while i < len(lines) and _TABLE_ROW.match(lines[i]):
                     tbl.append(lines[i]); i += 1
                 rows=[]
                 for j,row in enumerate(tbl):
@@ -228,3 +228,74 @@ class MarkdownToDocs:
             i += 1
 
         return self.requests
+
+
+# ---------- coalescing ----------
+_MERGEABLE_STYLES = ("updateTextStyle", "updateParagraphStyle")
+
+def _range_of(req: dict) -> dict:
+    return next(iter(req.values()))["range"]
+
+def _same_style(a: dict, b: dict) -> bool:
+    """Mismo tipo de op y mismo estilo/fields (solo cambia el rango)."""
+    (ka, va), (kb, vb) = next(iter(a.items())), next(iter(b.items()))
+    return ka == kb and {k: v for k, v in va.items() if k != "range"} == {k: v for k, v in vb.items() if k != "range"}
+
+def _touches(a: dict, b: dict) -> bool:
+    return b["startIndex"] <= a["endIndex"] and a["startIndex"] <= b["endIndex"]
+
+def coalesce_requests(requests: List[dict], max_insert_chars: int = 50_000) -> List[dict]:
+    """
+    Reduce las requests de `MarkdownToDocs.render` sin cambiar el resultado:
+    - Los `insertText` al final del segmento se adelantan sobre las ops que no
+      mueven índices (estilos, bullets) y se unen en uno (trozos de hasta
+      `max_insert_chars`). `insertTable` hace de barrera: lo que va detrás se
+      sigue insertando detrás.
+    - `updateTextStyle`/`updateParagraphStyle` consecutivos con el mismo estilo
+      y rangos adyacentes o solapados se unen en uno.
+    - Los `deleteParagraphBullets` (una por línea con list_policy="none") se
+      juntan en uno sobre el rango total, cerrado antes de cualquier
+      `createParagraphBullets` o barrera.
+    """
+    out: List[dict] = []
+    text: List[str] = []       # inserts pendientes del tramo actual
+    ops: List[dict] = []       # ops sin movimiento de índices del tramo actual
+    strip: dict | None = None  # rango acumulado de deleteParagraphBullets
+
+    def _flush_strip():
+        nonlocal strip
+        if strip:
+            ops.append({"deleteParagraphBullets": {"range": strip}})
+            strip = None
+
+    def _flush_segment():
+        _flush_strip()
+        joined = "".join(text)
+        step = max(1, max_insert_chars)
+        out.extend({"insertText": {"endOfSegmentLocation": {}, "text": joined[k:k + step]}}
+                   for k in range(0, len(joined), step))
+        out.extend(ops)
+        text.clear(); ops.clear()
+
+    for req in requests:
+        kind = next(iter(req))
+        body = req[kind]
+        if kind == "insertText" and "endOfSegmentLocation" in body:
+            text.append(body["text"])
+        elif kind == "deleteParagraphBullets":
+            r = body["range"]
+            strip = ({"startIndex": min(strip["startIndex"], r["startIndex"]),
+                      "endIndex": max(strip["endIndex"], r["endIndex"])} if strip else dict(r))
+        elif kind in _MERGEABLE_STYLES and ops and _same_style(ops[-1], req) and _touches(_range_of(ops[-1]), body["range"]):
+            prev = _range_of(ops[-1])
+            ops[-1] = {kind: {**body, "range": {"startIndex": min(prev["startIndex"], body["range"]["startIndex"]),
+                                                "endIndex": max(prev["endIndex"], body["range"]["endIndex"])}}}
+        elif kind in _MERGEABLE_STYLES or kind == "createParagraphBullets":
+            if kind == "createParagraphBullets": _flush_strip()
+            ops.append(req)
+        else:
+            # insertTable (o cualquier op que mueva índices): barrera
+            _flush_segment()
+            out.append(req)
+    _flush_segment()
+    return out
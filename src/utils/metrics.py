@@ -0,0 +1,29 @@
+# src/utils/metrics.py
+from __future__ import annotations
+
+import threading
+from typing import Any, Callable, Dict
+
+# Registro simple de "proveedores" de métricas: cada cliente registra una función
+# que devuelve un dict con su estado actual (contadores de caché, colas, etc.).
+_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+_lock = threading.Lock()
+
+
+def register_metrics(name: str, provider: Callable[[], Dict[str, Any]]) -> None:
+    """Registra (o reemplaza) el proveedor de métricas `name`."""
+    with _lock:
+        _providers[name] = provider
+
+
+def snapshot() -> Dict[str, Any]:
+    """Devuelve el estado actual de todas las métricas registradas."""
+    with _lock:
+        providers = dict(_providers)
+    out: Dict[str, Any] = {}
+    for name, provider in providers.items():
+        try:
+            out[name] = provider()
+        except Exception as e:
+            out[name] = {"error": e.__class__.__name__}
+    return out
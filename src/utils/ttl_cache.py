@@ -0,0 +1,109 @@
+# src/utils/ttl_cache.py
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """
+    Caché LRU en memoria, thread-safe, con expiración por TTL y desalojo por tamaño.
+    - `max_entries`: número máximo de entradas (LRU).
+    - `max_bytes` + `sizeof`: presupuesto opcional de tamaño total.
+    Lleva contadores de hits/misses/evictions para exponerlos como métricas.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int,
+        ttl_s: float,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[V], int]] = None,
+    ):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda _v: 0)
+        self._data: "OrderedDict[Hashable, Tuple[float, int, V]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[V]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, _, value = item
+            if expires_at <= now:
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: V) -> None:
+        size = int(self._sizeof(value))
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # no cabe: no desalojamos todo por una sola entrada
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl_s, size, value)
+            self._bytes += size
+            self._evict_locked()
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+    # ---------- internos (llamar con el lock tomado) ----------
+    def _drop(self, key: Hashable) -> None:
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def _evict_locked(self) -> None:
+        now = time.monotonic()
+        # 1) Expirados primero
+        for k in [k for k, (exp, _, _) in self._data.items() if exp <= now]:
+            self._drop(k)
+            self.evictions += 1
+        # 2) LRU por número de entradas y por bytes
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            oldest = next(iter(self._data))
+            self._drop(oldest)
+            self.evictions += 1
@@ -0,0 +1,21 @@
+# tests/batch_access.py
+import argparse
+
+from src.clients.drive_client import batch_get_file_metadata
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Valida acceso a varios archivos con una petición batch")
+    ap.add_argument("--file-ids", nargs="+", required=True)
+    ap.add_argument("--mode", choices=["docs", "drive"], default="docs")
+    args = ap.parse_args()
+
+    results = batch_get_file_metadata(args.file_ids, use_docs_api=args.mode == "docs")
+    for fid, item in results.items():
+        if item.ok:
+            logger.info(f"✅ {fid} | intentos={item.attempts} | {item.response}")
+        else:
+            logger.error(f"❌ {fid} | HTTP {item.status} | intentos={item.attempts} | {item.error}")
+    print({fid: item.ok for fid, item in results.items()})
@@ -0,0 +1,17 @@
+from src.clients.gdocs_client import get_cached_document_content
+from src.utils.metrics import snapshot
+from src.utils.logger import get_logger
+import argparse
+
+log = get_logger(__name__)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--doc-id", required=True)
+    ap.add_argument("--reads", type=int, default=3)
+    args = ap.parse_args()
+    for _ in range(args.reads):
+        txt = get_cached_document_content(args.doc_id)
+    stats = snapshot()["docs_content_cache"]
+    log.info(f"✅ Docs cache OK | chars={len(txt)} | hits={stats['hits']} misses={stats['misses']}")
+    print(stats)
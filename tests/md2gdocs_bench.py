@@ -0,0 +1,32 @@
+# tests/md2gdocs_bench.py
+from src.utils.md2gdocs import MarkdownToDocs
+import argparse
+import time
+
+PARA = "Texto con **negrita**, *cursiva*, `code`, ~~tachado~~ y [enlace](https://example.com). "
+# Sin enlaces/code/tachado: el tokenizer anterior re-buscaba esos patrones hasta el final
+# del párrafo en cada span (cuadrático); el combinado debe seguir lineal
+SPARSE = "Texto con **negrita** y *cursiva*, sin más marcas. "
+
+def build(size: int, long_lines: bool) -> str:
+    if long_lines:
+        # un único párrafo enorme: todo el coste está en el inline
+        return (SPARSE * (size // len(SPARSE) + 1))[:size]
+    block = "## Sección\n\n" + PARA * 5 + "\n\n- punto uno\n- punto dos\n\n> cita con *estilo*\n\n"
+    return (block * (size // len(block) + 1))[:size]
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--max-kb", type=int, default=1024)
+    ap.add_argument("--long-lines", action="store_true", help="Un solo párrafo largo en lugar de bloques")
+    args = ap.parse_args()
+
+    kb = 64
+    while kb <= args.max_kb:
+        md = build(kb * 1024, args.long_lines)
+        t0 = time.perf_counter()
+        reqs = MarkdownToDocs(1).render(md)
+        dt = time.perf_counter() - t0
+        # escalado lineal ⇔ µs/KB constante al crecer el tamaño
+        print(f"{kb:>6} KB  {len(reqs):>8} requests  {dt:7.3f}s  {dt * 1e6 / kb:8.1f} µs/KB")
+        kb *= 2